@@ -0,0 +1,187 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from collections import deque, namedtuple
+from DBRE_Reader import DTAFormatError, read_dta, stream_dta
+from DBRE_Plateau import PlateauDetector, sweep_plateau
+from DBRE_Derivatives import StreamingDerivatives, smooth_derivatives
+from DBRE_Profile import measurement_profile, stage
+
+# Per-measurement DBRE analysis and the work-queue driver that feeds it files.
+# analyze_measurement has no side effects: plotting and saving are left to the
+# handler given to run_measurements, so nothing from earlier files is kept alive.
+
+prefix = 'A_DBRE_#' #measurement files are named prefix + number + '.DTA'
+columns = ['Hours','Date','Time','Potential','Uncertainty','Plateau_Length'] #summary columns
+
+#start_time: start of experiment
+#max_time: do not evaluate past this number of seconds
+#slope_threshold: max value for slope of plateau
+#con_threshold: max value for second derivative of plateau, None to only use the slope
+#min_plateau_length: minimum number of points needed to have a plateau
+#spline_smoothing: smoothing of the spline used for concavity, None to use np.gradient
+#retry: whether to try reduced thresholds if no plateau is detected
+#derivative_window: points in the local polynomial fits of DBRE_Derivatives, used instead of np.gradient and the spline if given
+#early_exit: whether analyze_file stops reading a file once its plateau has ended. Only with derivative_window,
+#	as np.gradient and the spline need the whole trace; files are read in full without it.
+#threshold_grid: (slope_threshold, con_threshold, min_plateau_length) candidates tried in order if no plateau is
+#	detected with the thresholds above and retry is set, None for one try at slope/5, concavity/3 and length/1.5
+AnalysisParams = namedtuple('AnalysisParams', ['start_time', 'max_time', 'slope_threshold', 'con_threshold', 'min_plateau_length', 'spline_smoothing', 'retry', 'derivative_window', 'early_exit', 'threshold_grid'],
+	defaults = [600, 0.008, None, 15, None, False, None, False, None])
+
+#candidates is a DataFrame with the thresholds, plateau and result of every candidate that was evaluated
+Measurement = namedtuple('Measurement', ['summary', 'raw_data', 'trace', 'plateau_start', 'plateau_end', 'spline', 'slope_threshold', 'con_threshold', 'candidates'])
+
+trapezoid = getattr(np, 'trapezoid', None) or np.trapz
+
+#analyze one measurement and return its Measurement
+def analyze_measurement(header, times, voltages, params):
+	#filter out times past the maximum time before computing anything
+	keep = times <= params.max_time
+	raw_data = pd.DataFrame({'Time': times[keep], 'Voltage': voltages[keep]})
+
+	#create derivative and concavity columns. Local polynomial fits, or a spline of voltage over time, can be used to reduce noise in the concavity.
+	spline = None
+	with stage('derivatives'):
+		if params.derivative_window is not None:
+			derivatives = smooth_derivatives(raw_data.Time, raw_data.Voltage, params.derivative_window, break_time = header.charging_time)
+			raw_data['Derivative'] = derivatives[2]
+			raw_data['Concavity'] = derivatives[3]
+		elif params.spline_smoothing is None:
+			raw_data['Derivative'] = np.gradient(raw_data.Voltage,raw_data.Time)
+			raw_data['Concavity'] = np.gradient(raw_data.Derivative,raw_data.Time)
+		else:
+			import scipy.interpolate #only needed for spline smoothing
+			raw_data['Derivative'] = np.gradient(raw_data.Voltage,raw_data.Time)
+			spline = scipy.interpolate.splrep(raw_data.Time,raw_data.Voltage,k=3,s=params.spline_smoothing)
+			raw_data['Concavity'] = scipy.interpolate.splev(raw_data.Time,spline,der=2)
+	return summarize_measurement(header, raw_data, spline, params)
+
+#analyze a measurement whose (time, voltage) rows come in chunks, e.g. from stream_dta, and return
+#its Measurement, or None if there are no rows. Derivatives are computed as the rows arrive and
+#no more chunks are taken once the plateau has ended, so raw_data stops shortly after the plateau.
+def analyze_stream(header, chunks, params):
+	stream = StreamingDerivatives(params.derivative_window, max_time = params.max_time, break_time = header.charging_time)
+	detector = PlateauDetector(params.slope_threshold, params.con_threshold, params.min_plateau_length)
+	parts = []
+
+	#feed the points of the trace to the detector, and return whether the plateau is known
+	def add(part):
+		parts.append(part)
+		after_charging = part[0] > header.charging_time
+		return detector.feed(part[2][after_charging], part[3][after_charging])
+	ended = False
+	for times, voltages in chunks:
+		ended = add(stream.feed(times, voltages))
+		if ended or stream.finished:
+			break
+	chunks.close()
+	if not ended:
+		add(stream.finish())
+	times, voltages, derivative, concavity = (np.concatenate(column) for column in zip(*parts))
+	if len(times) == 0:
+		return None
+	raw_data = pd.DataFrame({'Time': times, 'Voltage': voltages, 'Derivative': derivative, 'Concavity': concavity})
+	return summarize_measurement(header, raw_data, None, params)
+
+#find the plateau of a measurement with derivative and concavity columns and return its Measurement
+def summarize_measurement(header, raw_data, spline, params):
+	dt = header.datetime - params.start_time
+	hours = dt.total_seconds()/3600
+
+	#extract voltage and plateau length using thresholds on the derivatives. All candidate thresholds are
+	#evaluated at once; the first one whose plateau ends before max_time is used, or the last one if none does.
+	trace = raw_data[raw_data.Time > header.charging_time].reset_index(drop = True)
+	candidates = plateau_candidates(params)
+	with stage('plateau'):
+		starts, ends = sweep_plateau(trace.Derivative, trace.Concavity, candidates)
+	found = trace.Time.to_numpy()[ends] < params.max_time if len(trace) else np.zeros(len(candidates), dtype = bool)
+	best = int(found.argmax()) if found.any() else len(candidates) - 1
+	slope_threshold, con_threshold, min_length = candidates[best]
+	plateau_start, plateau_end = int(starts[best]), int(ends[best])
+
+	#calculate plateau length, average potential, and uncertainty of every candidate
+	stats = [plateau_stats(trace, start, end) for start, end in zip(starts, ends)]
+	plateau, voltage, uncertainty = stats[best]
+	diagnostics = pd.DataFrame(candidates, columns = ['Slope_Threshold', 'Con_Threshold', 'Min_Length'])
+	diagnostics['Start'], diagnostics['End'], diagnostics['Found'] = starts, ends, found
+	diagnostics['Plateau_Length'], diagnostics['Potential'], diagnostics['Uncertainty'] = zip(*stats) if stats else ([], [], [])
+
+	summary = {'Hours': hours, 'Date': header.date,'Time': header.time,'Potential': voltage,'Uncertainty': uncertainty, 'Plateau_Length': plateau}
+	return Measurement(summary, raw_data, trace, plateau_start, plateau_end, spline, slope_threshold, con_threshold, diagnostics)
+
+#(slope_threshold, con_threshold, min_plateau_length) candidates for the plateau, in order of preference
+def plateau_candidates(params):
+	candidates = [(params.slope_threshold, params.con_threshold, params.min_plateau_length)]
+	if params.retry and params.threshold_grid is not None:
+		candidates += [tuple(c) for c in params.threshold_grid]
+	elif params.retry:
+		con_threshold = params.con_threshold/3 if params.con_threshold is not None else None
+		candidates.append((params.slope_threshold/5, con_threshold, params.min_plateau_length/1.5))
+	return candidates
+
+#(length in seconds, average potential, uncertainty) of the plateau from start up to end, NaN if it has under two points
+def plateau_stats(trace, start, end):
+	plateau_time = trace.Time.to_numpy()[start:end]
+	plateau_voltage = trace.Voltage.to_numpy()[start:end]
+	if len(plateau_time) < 2:
+		return np.nan, np.nan, np.nan
+	plateau = trapezoid(np.ones(len(plateau_time)), x = plateau_time) #time of plateau length
+	voltage = -trapezoid(plateau_voltage, x = plateau_time)/plateau #numerical integral to average voltage
+	uncertainty = (max(plateau_voltage) - min(plateau_voltage))/2 #estimate uncertainty as voltage window divided by 2
+	return plateau, voltage, uncertainty
+
+#number N of a measurement file named prefix + N + '.DTA'
+def measurement_number(filename):
+	return int(os.path.basename(filename)[len(prefix):-len('.DTA')])
+
+#file of measurement number N in a folder
+def measurement_file(folder, number):
+	return os.path.join(folder, prefix + str(number) + '.DTA')
+
+#measurement files present in a folder, in measurement order
+def discover_measurements(folder = '.'):
+	numbers = []
+	for name in os.listdir(folder):
+		if name.startswith(prefix) and name.endswith('.DTA') and name[len(prefix):-len('.DTA')].isdigit():
+			numbers.append(int(name[len(prefix):-len('.DTA')]))
+	return [measurement_file(folder, number) for number in sorted(numbers)]
+
+#load and analyze one file, re-reading it every retry_time seconds while it has no data.
+#Returns None for a file without data when retry_time is None. A malformed file raises DTAFormatError instead of being retried.
+#With params.early_exit and params.derivative_window, files loaded with read_dta are streamed and only read up to the end of their plateau.
+def analyze_file(filename, params, load = read_dta, retry_time = None):
+	while True:
+		if params.early_exit and params.derivative_window is not None and load is read_dta:
+			with stage('stream'):
+				measurement = analyze_stream(*stream_dta(filename), params)
+		else:
+			with stage('load'):
+				header, times, voltages = load(filename)
+			measurement = analyze_measurement(header, times, voltages, params) if len(times) else None
+		if measurement is not None or retry_time is None:
+			return measurement
+		time.sleep(retry_time)
+
+#analyze each file in turn and pass it with its Measurement to handle(filename, measurement).
+#load(filename) returns (header, time, voltage). Files that come back without data are
+#skipped, or re-read after retry_time seconds if it is given. Malformed files are reported and skipped.
+#pause is slept between files.
+#Each file is one measurement for DBRE_Profile, covering the analysis and handle.
+def run_measurements(filenames, params, handle, load = read_dta, pause = 0, retry_time = None):
+	queue = deque(filenames)
+	while queue:
+		filename = queue.popleft()
+		with measurement_profile(filename):
+			try:
+				measurement = analyze_file(filename, params, load, retry_time)
+				if measurement is None:
+					print('skipped %s: no data' % filename)
+			except DTAFormatError as error:
+				print('skipped %s' % error)
+				measurement = None
+			if measurement is not None:
+				handle(filename, measurement)
+		if queue and pause:
+			time.sleep(pause)
@@ -0,0 +1,118 @@
+import os
+import json
+import argparse
+import numpy as np
+from datetime import datetime
+from DBRE_Reader import DTAFormatError, DTAHeader, read_dta
+from DBRE_Analysis import discover_measurements, measurement_file, measurement_number
+
+# Archive of the raw traces of many .DTA files, for studies across whole campaigns. The time
+# and voltage columns of every measurement are stored one after another in two flat binary
+# files, with an index giving the offset and length of each measurement. Opening the archive
+# memory-maps the columns, so it opens instantly and a measurement is a zero-copy slice:
+#	python DBRE_Archive.py archive_folder [folder ...] [--dtype float32]
+# adds the measurements of the folders (all subfolders with measurements if none are given)
+# that are not in the archive yet. float32 columns take half the space of float64, with about
+# 7 significant digits; the dtype is chosen when the archive is created.
+
+index_name = 'index.npy'
+meta_name = 'archive.json'
+column_names = {'time': 'time.bin', 'voltage': 'voltage.bin'}
+index_dtype = np.dtype([('folder', 'U256'), ('number', np.int32), ('offset', np.int64), ('length', np.int64),
+	('date', 'U10'), ('time', 'U8'), ('charging_time', np.float64), ('points', np.int64)])
+
+#(meta, index) of the archive in path: its column dtype and row count, and its index
+def read_index(path):
+	with open(os.path.join(path, meta_name)) as f:
+		meta = json.load(f)
+	return meta, np.load(os.path.join(path, index_name))
+
+#add the measurements of folders to the archive in path, creating it with columns of dtype if needed.
+#Returns the number added. The columns are appended to without mapping them, so it also works on Windows.
+def build_archive(path, folders, dtype = np.float64):
+	os.makedirs(path, exist_ok = True)
+	if os.path.isfile(os.path.join(path, meta_name)):
+		meta, index = read_index(path)
+		dtype, offset, index = np.dtype(meta['dtype']), int(meta['rows']), list(index)
+	else:
+		dtype, offset, index = np.dtype(dtype), 0, []
+	present = {(row['folder'], int(row['number'])) for row in index}
+	added = 0
+	with open(os.path.join(path, column_names['time']), 'ab') as time_file, open(os.path.join(path, column_names['voltage']), 'ab') as voltage_file:
+		#drop rows written by an earlier build that stopped before saving its index
+		time_file.truncate(offset*dtype.itemsize)
+		voltage_file.truncate(offset*dtype.itemsize)
+		for folder in folders:
+			folder = os.path.normpath(folder)
+			for filename in discover_measurements(folder):
+				number = measurement_number(filename)
+				if (folder, number) in present:
+					continue
+				try:
+					header, times, voltages = read_dta(filename)
+				except DTAFormatError as error:
+					print('skipped %s' % error)
+					continue
+				if len(times) == 0:
+					continue #not written yet, picked up next time
+				time_file.write(times.astype(dtype).tobytes())
+				voltage_file.write(voltages.astype(dtype).tobytes())
+				charging_time = header.charging_time if header.charging_time is not None else np.nan
+				points = header.points if header.points is not None else -1
+				index.append((folder, number, offset, len(times), header.date or '', header.time or '', charging_time, points))
+				offset += len(times)
+				added += 1
+	np.save(os.path.join(path, index_name), np.array(index, dtype = index_dtype))
+	with open(os.path.join(path, meta_name), 'w') as f:
+		json.dump({'dtype': dtype.name, 'rows': offset}, f)
+	return added
+
+class DTAArchive:
+	def __init__(self, path):
+		meta, self.index = read_index(path)
+		self.path = path
+		self.dtype = np.dtype(meta['dtype'])
+		self.rows = meta['rows']
+		self.positions = {(row['folder'], int(row['number'])): i for i, row in enumerate(self.index)}
+		self.times = self._column('time')
+		self.voltages = self._column('voltage')
+
+	#memory-mapped column, or an empty array for an empty archive
+	def _column(self, name):
+		if self.rows == 0:
+			return np.empty(0, dtype = self.dtype)
+		return np.memmap(os.path.join(self.path, column_names[name]), dtype = self.dtype, mode = 'r', shape = (self.rows,))
+
+	def __len__(self):
+		return len(self.index)
+
+	#(header, time, voltage) of the i-th measurement. time and voltage are views of the archive.
+	def measurement(self, i):
+		row = self.index[i]
+		stop = row['offset'] + row['length']
+		stamp = None
+		if row['date'] and row['time']:
+			stamp = datetime.strptime(row['date'] + ' ' + row['time'], '%m/%d/%Y %H:%M:%S')
+		charging_time = None if np.isnan(row['charging_time']) else float(row['charging_time'])
+		points = None if row['points'] < 0 else int(row['points'])
+		header = DTAHeader(str(row['date']) or None, str(row['time']) or None, stamp, charging_time, points, {})
+		return header, self.times[row['offset']:stop], self.voltages[row['offset']:stop]
+
+	#(header, time, voltage) of a measurement by its file name, so that the archive can stand in for read_dta,
+	#e.g. analyze_file(filename, params, load = archive.load)
+	def load(self, filename):
+		return self.measurement(self.positions[(os.path.normpath(os.path.dirname(filename) or '.'), measurement_number(filename))])
+
+	#file names of the archived measurements, in archive order
+	def filenames(self):
+		return [measurement_file(row['folder'], int(row['number'])) for row in self.index]
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument('archive', help = 'archive folder')
+	parser.add_argument('folders', nargs = '*', help = 'experiment folders to add, all subfolders with measurements if none are given')
+	parser.add_argument('--dtype', choices = ['float64', 'float32'], default = 'float64', help = 'column type of a new archive')
+	args = parser.parse_args()
+	folders = args.folders or sorted(d.path for d in os.scandir('.') if d.is_dir() and os.path.isfile(measurement_file(d.path, 1)))
+	added = build_archive(args.archive, folders, args.dtype)
+	print('added %d measurements to %s' % (added, args.archive))
@@ -0,0 +1,227 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from DBRE_Reader import read_dta
+from DBRE_Export import RawWriter, extensions, resolve_sink, sinks, write_raw
+from DBRE_Analysis import AnalysisParams, analyze_file, analyze_measurement, discover_measurements, measurement_number
+from DBRE_Derivatives import smooth_derivatives
+from DBRE_Plateau import detect_plateau
+from DBRE_Store import SummaryStore
+from DBRE_Synthetic import write_dta, write_folder
+
+# Microbenchmarks for the DBRE analysis pipeline. Run from a folder of .DTA files,
+# or pass the files to time on the command line:
+#	python DBRE_Benchmark.py [A_DBRE_#1.DTA ...] [--output results.json] [--baseline old.json]
+# Each pipeline stage is also timed on synthetic files of several sizes, and whole batches
+# on synthetic folder trees. These results are written to a JSON file; given the file of an
+# earlier run as --baseline, stages that got slower than --tolerance times are reported and
+# the exit status is 1, so regressions can be caught before committing.
+
+repeat = 5 #number of passes over the files for each timing
+sizes = [1000, 6000, 20000] #points in the synthetic files timed stage by stage
+folder_counts = [1, 4, 16] #number of synthetic folders in the batch timings
+folder_measurements = 5 #measurements in each synthetic folder
+plateau_voltage = -1.2 #plateau of the synthetic files, the analysis should find a potential of 1.2 V
+params = AnalysisParams(datetime(2020, 10, 27, 15, 0, 0), 600, 0.008, 0.001, 15, None, True, 21)
+
+#the original approach: read_csv for the data, then readlines again for the header
+def read_two_pass(filename):
+	raw_data = pd.read_csv(filename, sep = '\t', header = None, usecols = [2,3], skiprows = 64, names = ['Time','Voltage'])
+	f = open(filename, 'r')
+	lines = f.readlines()
+	datestamp = lines[3].split('\t')[2]
+	timestamp = lines[4].split('\t')[2]
+	charging_time = float(lines[11].split('\t')[2])
+	f.close()
+	return raw_data, datestamp, timestamp, charging_time
+
+#best time in seconds per item of reader over all items
+def time_reader(reader, files):
+	best = float('inf')
+	for i in range(repeat):
+		start = time.perf_counter()
+		for filename in files:
+			reader(filename)
+		best = min(best, time.perf_counter() - start)
+	return best/len(files)
+
+def bench_reader(files):
+	two_pass = time_reader(read_two_pass, files)
+	single_pass = time_reader(read_dta, files)
+	print('%d files, best of %d' % (len(files), repeat))
+	print('two-pass read_csv + readlines: %8.3f ms/file' % (two_pass*1000))
+	print('single-pass read_dta:          %8.3f ms/file' % (single_pass*1000))
+	print('speedup: %.2fx' % (two_pass/single_pass))
+
+#best wall time in seconds of starting python and running code
+def time_startup(code):
+	best = float('inf')
+	for i in range(repeat):
+		start = time.perf_counter()
+		subprocess.run([sys.executable, '-c', code], check = True, cwd = os.path.dirname(os.path.abspath(__file__)))
+		best = min(best, time.perf_counter() - start)
+	return best
+
+#startup time of a headless run, which only loads the analysis modules, against one that plots
+def bench_startup():
+	print('startup, best of %d' % repeat)
+	analysis = 'import DBRE_Analysis, DBRE_Store, DBRE_Export, DBRE_Follow'
+	for name, code in [('python alone', 'pass'), ('analysis only', analysis),
+			('with plots and spline', analysis + '; import DBRE_Plotting, scipy.interpolate; DBRE_Plotting.pyplot()')]:
+		print('%-24s %8.1f ms' % (name, time_startup(code)*1000))
+
+#raw data frame of a file as the analyzer exports it
+def raw_frame(filename):
+	header, times, voltages = read_dta(filename)
+	raw_data = pd.DataFrame({'Time': times, 'Voltage': voltages})
+	raw_data['Derivative'] = np.gradient(raw_data.Voltage, raw_data.Time)
+	raw_data['Concavity'] = np.gradient(raw_data.Derivative, raw_data.Time)
+	return raw_data
+
+#files per second written by each raw export sink, and how long analysis is blocked per file
+#when the writes go through the background writer instead
+def bench_export(files):
+	frames = [raw_frame(filename) for filename in files]
+	print('raw export of %d files, best of %d' % (len(frames), repeat))
+	with tempfile.TemporaryDirectory() as folder:
+		names = [os.path.join(folder, str(i)) for i in range(len(frames))]
+		for sink in sinks[1:]:
+			if resolve_sink(sink) != sink:
+				continue #pyarrow missing
+			def direct(i):
+				write_raw(frames[i], names[i], sink)
+			per_file = time_reader(direct, range(len(frames)))
+			writer = RawWriter(sink, backlog = len(frames))
+			start = time.perf_counter()
+			for i in range(len(frames)):
+				writer.submit(frames[i], names[i])
+			blocked = (time.perf_counter() - start)/len(frames)
+			writer.close()
+			size = sum(os.path.getsize(name + extensions[sink]) for name in names)/len(frames)
+			print('%-8s %8.1f files/s %8.1f kB/file, analysis blocked %.3f ms/file in background' % (sink, 1/per_file, size/1000, blocked*1000))
+
+#best time in seconds of one call of function
+def best_time(function):
+	best = float('inf')
+	for i in range(repeat):
+		start = time.perf_counter()
+		function()
+		best = min(best, time.perf_counter() - start)
+	return best
+
+#time each stage of the analysis of one synthetic file per size
+def bench_stages(folder):
+	from DBRE_Render import render, trace_job
+	import scipy.interpolate
+	sink = resolve_sink('feather')
+	results = []
+	for points in sizes:
+		filename = os.path.join(folder, 'A_DBRE_#%d.DTA' % points)
+		write_dta(filename, points = points, plateau_voltage = plateau_voltage)
+		header, times, voltages = read_dta(filename)
+		measurement = analyze_measurement(header, times, voltages, params)
+		trace = measurement.trace
+		spline_params = params._replace(derivative_window = None, spline_smoothing = 0.0005)
+		stages = [
+			('parse', lambda: read_dta(filename)),
+			('gradient', lambda: np.gradient(np.gradient(voltages, times), times)),
+			('smooth_derivatives', lambda: smooth_derivatives(times, voltages, params.derivative_window, break_time = header.charging_time)),
+			('spline', lambda: scipy.interpolate.splev(times, scipy.interpolate.splrep(times, voltages, k = 3, s = 0.0005), der = 2)),
+			('plateau', lambda: detect_plateau(trace.Derivative, trace.Concavity, params.slope_threshold, params.con_threshold, params.min_plateau_length)),
+			('analysis', lambda: analyze_file(filename, params)),
+			('analysis_spline', lambda: analyze_file(filename, spline_params)),
+			('analysis_early_exit', lambda: analyze_file(filename, params._replace(early_exit = True))),
+			('export_' + sink, lambda: write_raw(measurement.raw_data, filename[:-4], sink)),
+			('plot', lambda: render(trace_job(filename, measurement, 'batch', params.max_time))),
+			('plot_thumbnail', lambda: render(trace_job(filename, measurement, 'batch', params.max_time, thumbnail = True)))]
+		for stage, function in stages:
+			seconds = best_time(function)
+			results.append({'stage': stage, 'points': points, 'seconds': seconds, 'points_per_second': points/seconds})
+			print('%-20s %6d points %10.3f ms %12.0f points/s' % (stage, points, seconds*1000, points/seconds))
+	return results
+
+#time a whole batch, as DBRE_Script_Glob.py without plots or raw export, over synthetic folder trees.
+#The largest error in the potentials found is kept to catch changes that break the analysis.
+def bench_folders(folder):
+	results = []
+	for count in folder_counts:
+		root = os.path.join(folder, 'tree%d' % count)
+		folders = [os.path.join(root, 'cell%d' % i) for i in range(count)]
+		for f in folders:
+			write_folder(f, folder_measurements, plateau_voltage = plateau_voltage)
+		errors = []
+		def batch():
+			for f in folders:
+				store = SummaryStore(f)
+				rows = [(measurement_number(filename), analyze_file(filename, params).summary) for filename in discover_measurements(f)]
+				store.append_many(rows)
+				store.close()
+				errors.extend(abs(summary['Potential'] + plateau_voltage) for number, summary in rows)
+		seconds = best_time(batch)
+		measurements = count*folder_measurements
+		results.append({'stage': 'batch', 'folders': count, 'measurements': measurements, 'seconds': seconds,
+			'measurements_per_second': measurements/seconds, 'potential_error': max(errors)})
+		print('batch %3d folders %4d measurements %10.3f ms %8.1f measurements/s, potential error %.4f V' % (count, measurements, seconds*1000, measurements/seconds, max(errors)))
+	return results
+
+#key identifying a result across runs
+def result_key(result):
+	return (result['stage'], result.get('points'), result.get('folders'))
+
+#readable name of a result
+def result_name(result):
+	if 'folders' in result:
+		return '%s of %d folders' % (result['stage'], result['folders'])
+	return '%s of %d points' % (result['stage'], result['points'])
+
+#report results that are slower than tolerance times their baseline, or whose potential error grew
+def compare(results, baseline, tolerance):
+	previous = {result_key(result): result for result in baseline['results']}
+	regressions = 0
+	for result in results:
+		old = previous.get(result_key(result))
+		if old is None:
+			continue
+		ratio = result['seconds']/old['seconds']
+		if ratio > tolerance:
+			regressions += 1
+			print('slower: %s %.2fx (%.3f ms, was %.3f ms)' % (result_name(result), ratio, result['seconds']*1000, old['seconds']*1000))
+		if result.get('potential_error', 0) > max(old.get('potential_error', 0)*2, 0.001):
+			regressions += 1
+			print('less accurate: %d folders, potential error %.4f V (was %.4f V)' % (result['folders'], result['potential_error'], old['potential_error']))
+	return regressions
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument('files', nargs = '*', help = '.DTA files for the reader and export benchmarks, A*.DTA if none are given')
+	parser.add_argument('--output', default = 'DBRE_Benchmark.json', help = 'file the stage and batch timings are written to')
+	parser.add_argument('--baseline', help = 'results of an earlier run to compare with')
+	parser.add_argument('--tolerance', type = float, default = 1.25, help = 'slowdown over the baseline that counts as a regression')
+	args = parser.parse_args()
+
+	bench_startup()
+	files = args.files or sorted(glob.glob('A*.DTA'))
+	if files:
+		bench_reader(files)
+		bench_export(files)
+	with tempfile.TemporaryDirectory() as folder:
+		results = bench_stages(folder) + bench_folders(folder)
+	with open(args.output, 'w') as f:
+		json.dump({'date': datetime.now().isoformat(timespec = 'seconds'), 'python': platform.python_version(),
+			'numpy': np.__version__, 'pandas': pd.__version__, 'repeat': repeat, 'results': results}, f, indent = 1)
+	print('results written to ' + args.output)
+	if args.baseline:
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+		if compare(results, baseline, args.tolerance):
+			sys.exit(1)
+		print('no regressions against ' + args.baseline)
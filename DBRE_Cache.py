@@ -0,0 +1,60 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+# Cache of measurement summaries so that re-runs skip .DTA files that have not changed.
+# A file is taken as unchanged while its size and modification time are the same; the
+# analysis parameters and the outputs written for each file (plots, raw export) are hashed
+# into the key, so changing any of them re-analyzes every file. The least recently used entries are dropped once there are more than max_entries.
+
+cache_name = 'DBRE_Cache.db'
+
+#hash of the analysis parameters and of the outputs written for each file
+def params_key(params, outputs = None):
+	return hashlib.sha1(repr((tuple(params), outputs)).encode()).hexdigest()
+
+class ResultCache:
+	def __init__(self, filename = cache_name, params = None, max_entries = 100000, outputs = None):
+		self.params = params_key(params, outputs)
+		self.max_entries = max_entries
+		self.connection = sqlite3.connect(filename)
+		self.connection.execute('CREATE TABLE IF NOT EXISTS results (Path TEXT, Size INTEGER, Mtime INTEGER, Params TEXT, Summary TEXT, Used REAL, PRIMARY KEY (Path, Size, Mtime, Params))')
+
+	#(path, size, mtime) of a file as it is now
+	def _key(self, filename):
+		stat = os.stat(filename)
+		return os.path.abspath(filename), stat.st_size, stat.st_mtime_ns
+
+	#stored summaries of several files, None for each file that changed or was never analyzed with these parameters
+	def get_many(self, filenames):
+		summaries = []
+		used = []
+		for filename in filenames:
+			key = self._key(filename) + (self.params,)
+			row = self.connection.execute('SELECT Summary FROM results WHERE Path = ? AND Size = ? AND Mtime = ? AND Params = ?', key).fetchone()
+			summaries.append(None if row is None else json.loads(row[0]))
+			if row is not None:
+				used.append(key)
+		now = time.time()
+		with self.connection:
+			self.connection.executemany('UPDATE results SET Used = ? WHERE Path = ? AND Size = ? AND Mtime = ? AND Params = ?', [(now,) + key for key in used])
+		return summaries
+
+	def get(self, filename):
+		return self.get_many([filename])[0]
+
+	#store the summaries of [(filename, summary), ...] and evict the oldest entries past max_entries
+	def put_many(self, rows):
+		now = time.time()
+		values = [self._key(filename) + (self.params, json.dumps(summary), now) for filename, summary in rows]
+		with self.connection:
+			self.connection.executemany('INSERT OR REPLACE INTO results VALUES (?,?,?,?,?,?)', values)
+			self.connection.execute('DELETE FROM results WHERE rowid IN (SELECT rowid FROM results ORDER BY Used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+	def put(self, filename, summary):
+		self.put_many([(filename, summary)])
+
+	def close(self):
+		self.connection.close()
@@ -0,0 +1,123 @@
+import numpy as np
+
+# Smoothed first and second derivatives of voltage over time, computed chunk by chunk as a
+# trace arrives instead of fitting one spline to the whole trace. Each point gets the
+# derivatives of a polynomial fitted by least squares to the window of points centred on it
+# (a Savitzky-Golay filter that uses the actual sample times), so a point is known once
+# window//2 later points have arrived and only the last window points are kept.
+# Points past max_time are dropped before anything is computed. No fit spans break_time, so
+# the jump at the end of the charging step is not smoothed into the start of the discharge.
+
+default_window = 21 #points in each fit, odd. At 0.1 s per point this is 2 s.
+default_order = 2 #degree of the fitted polynomials, at least 2 for the second derivative
+
+#first and second derivative at x of the polynomials with coefficients coef (lowest degree first)
+def _derivatives(coef, x):
+	derivative = np.zeros(np.broadcast(coef[..., 0], x).shape)
+	concavity = np.zeros_like(derivative)
+	for k in range(1, coef.shape[-1]):
+		derivative += k*coef[..., k]*x**(k - 1)
+		if k >= 2:
+			concavity += k*(k - 1)*coef[..., k]*x**(k - 2)
+	return derivative, concavity
+
+class StreamingDerivatives:
+	def __init__(self, window = default_window, order = default_order, max_time = None, break_time = None):
+		if window % 2 == 0 or window <= order:
+			raise ValueError('window must be odd and longer than the polynomial order')
+		if order < 2:
+			raise ValueError('order must be at least 2 for the second derivative')
+		self.window = window
+		self.order = order
+		self.max_time = max_time
+		self.break_time = break_time #the fits before and after this time are kept apart, None for no break
+		self.finished = False #set once a point past max_time has been seen
+		self.filter = None
+		self._reset()
+
+	def _reset(self):
+		self.times = np.empty(0) #last window - 1 points, still needed for the next fits
+		self.voltages = np.empty(0)
+		self.started = False #whether the points before the first full window were given out
+		self.last_fit = None #(centre time, coefficients) of the last window, for the points after it
+
+	#pseudo-inverse of the fit matrix of a window of points step seconds apart, kept for the last step seen
+	def _filter(self, step):
+		if self.filter is None or self.filter[0] != step:
+			x = (np.arange(self.window) - self.window//2)*step
+			self.filter = (step, np.linalg.pinv(x[:, None]**np.arange(self.order + 1)))
+		return self.filter[1]
+
+	#add new points and return (time, voltage, derivative, concavity) of the points whose window is now complete
+	def feed(self, times, voltages):
+		times = np.asarray(times, dtype = np.float64)
+		voltages = np.asarray(voltages, dtype = np.float64)
+		if self.finished:
+			return times[:0], voltages[:0], times[:0], times[:0]
+		if self.max_time is not None and len(times) and times[-1] > self.max_time:
+			keep = np.searchsorted(times, self.max_time, side = 'right')
+			times, voltages = times[:keep], voltages[:keep]
+			self.finished = True
+		if self.break_time is not None and len(times) and times[-1] > self.break_time:
+			#finish the points up to the break, then start over after it
+			cut = np.searchsorted(times, self.break_time, side = 'right')
+			parts = [self._feed(times[:cut], voltages[:cut]), self.finish()]
+			self._reset()
+			self.break_time = None
+			parts.append(self._feed(times[cut:], voltages[cut:]))
+			return tuple(np.concatenate(column) for column in zip(*parts))
+		return self._feed(times, voltages)
+
+	def _feed(self, times, voltages):
+		t = np.concatenate([self.times, times])
+		v = np.concatenate([self.voltages, voltages])
+		half = self.window//2
+		if len(t) < self.window:
+			self.times, self.voltages = t, v
+			return t[:0], v[:0], t[:0], t[:0]
+
+		#least squares fit of each window around its centre time. With evenly spaced points every
+		#window has the same fit matrix, so the fits are one product with its pseudo-inverse.
+		tw = np.lib.stride_tricks.sliding_window_view(t, self.window)
+		vw = np.lib.stride_tricks.sliding_window_view(v, self.window)
+		centres = tw[:, half]
+		steps = np.diff(t)
+		if np.ptp(steps) <= 1e-6*abs(steps[0]):
+			coef = vw @ self._filter(steps.mean()).T
+		else:
+			powers = (tw - centres[:, None])[..., None]**np.arange(self.order + 1)
+			normal = np.einsum('nwi,nwj->nij', powers, powers)
+			coef = np.linalg.solve(normal, np.einsum('nwi,nw->ni', powers, vw)[..., None])[..., 0]
+		derivative, concavity = _derivatives(coef, 0.0)
+		start, end = half, half + len(centres)
+
+		#the first points have no window centred on them, use the first fit
+		if not self.started:
+			edge_derivative, edge_concavity = _derivatives(coef[0], t[:half] - centres[0])
+			derivative = np.concatenate([edge_derivative, derivative])
+			concavity = np.concatenate([edge_concavity, concavity])
+			start = 0
+			self.started = True
+		self.last_fit = (centres[-1], coef[-1])
+		self.times, self.voltages = t[-(self.window - 1):], v[-(self.window - 1):]
+		return t[start:end], v[start:end], derivative, concavity
+
+	#(time, voltage, derivative, concavity) of the points still held back once the trace has ended
+	def finish(self):
+		t, v = self.times, self.voltages
+		self.times, self.voltages = t[:0], v[:0]
+		if not self.started:
+			#too short for a single window
+			if len(t) < 2:
+				return t, v, np.zeros_like(t), np.zeros_like(t)
+			derivative = np.gradient(v, t)
+			return t, v, derivative, np.gradient(derivative, t)
+		t, v = t[self.window//2:], v[self.window//2:]
+		derivative, concavity = _derivatives(self.last_fit[1], t - self.last_fit[0])
+		return t, v, derivative, concavity
+
+#derivative and concavity of a whole trace, cut at max_time, as (time, voltage, derivative, concavity)
+def smooth_derivatives(times, voltages, window = default_window, order = default_order, max_time = None, break_time = None):
+	stream = StreamingDerivatives(window, order, max_time, break_time)
+	parts = [stream.feed(times, voltages), stream.finish()]
+	return tuple(np.concatenate(column) for column in zip(*parts))
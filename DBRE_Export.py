@@ -0,0 +1,84 @@
+import queue
+import threading
+import numpy as np
+from contextlib import nullcontext
+from DBRE_Profile import current_measurement, measurement_profile, stage
+
+# Export of the raw Time/Voltage/Derivative/Concavity data of each measurement.
+# Sinks: 'none', 'npz' (compressed NumPy), 'parquet', 'feather' or 'xlsx'. Parquet and
+# Feather need pyarrow; xlsx goes through openpyxl and is by far the slowest.
+
+sinks = ['none', 'npz', 'parquet', 'feather', 'xlsx']
+extensions = {'npz': '.npz', 'parquet': '.parquet', 'feather': '.feather', 'xlsx': '.xlsx'}
+default_sink = 'feather'
+
+try:
+	import pyarrow
+except ImportError:
+	pyarrow = None
+
+#the sink that will actually be used: Parquet and Feather fall back to npz without pyarrow
+def resolve_sink(sink):
+	if sink not in sinks:
+		raise ValueError('unknown raw export sink %r, use one of %s' % (sink, ', '.join(sinks)))
+	if sink in ('parquet', 'feather') and pyarrow is None:
+		print('pyarrow is not installed, saving raw data as npz instead of ' + sink)
+		return 'npz'
+	return sink
+
+#write raw_data to filename + the extension of the sink
+def write_raw(raw_data, filename, sink = default_sink):
+	if sink == 'none':
+		return
+	if sink == 'xlsx':
+		raw_data.to_excel(filename + '.xlsx')
+		return
+	raw_data = raw_data.reset_index(drop = True)
+	if sink == 'npz':
+		np.savez_compressed(filename + '.npz', **{name: raw_data[name].to_numpy() for name in raw_data.columns})
+	elif sink == 'parquet':
+		raw_data.to_parquet(filename + '.parquet')
+	elif sink == 'feather':
+		raw_data.to_feather(filename + '.feather')
+
+#writes raw data on a background thread so that analysis does not wait on the disk.
+#Errors from the thread are raised again by close(). A write submitted while a measurement is
+#profiled is timed as its 'export' stage, in a record of its own.
+class RawWriter:
+	def __init__(self, sink = default_sink, backlog = 16):
+		self.sink = resolve_sink(sink)
+		self.queue = queue.Queue(backlog) #submit blocks once this many writes are waiting
+		self.error = None
+		self.thread = threading.Thread(target = self._run, daemon = True)
+		self.thread.start()
+
+	def _run(self):
+		while True:
+			item = self.queue.get()
+			if item is None:
+				break
+			raw_data, filename, measurement = item
+			if self.error is None:
+				try:
+					with measurement_profile(measurement) if measurement is not None else nullcontext(), stage('export'):
+						write_raw(raw_data, filename, self.sink)
+				except Exception as error:
+					self.error = error
+
+	#queue raw_data to be written to filename + extension
+	def submit(self, raw_data, filename):
+		if self.sink != 'none':
+			self.queue.put((raw_data, filename, current_measurement()))
+
+	#wait for all queued writes to finish
+	def close(self):
+		self.queue.put(None)
+		self.thread.join()
+		if self.error is not None:
+			raise self.error
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
@@ -0,0 +1,140 @@
+import os
+import time
+import numpy as np
+from DBRE_Reader import DTAFormatError, data_tag, max_header_lines, parse_header, column_indices, parse_rows
+
+# Follow mode for .DTA files that the potentiostat is still writing. A byte offset is
+# kept for each file so that every poll only parses the rows appended since the last one.
+# inotify is used to wake up on writes when the inotify_simple package is installed;
+# otherwise the file is polled.
+
+try:
+	from inotify_simple import INotify, flags
+except ImportError:
+	INotify = None
+
+poll_interval = 0.5 #seconds between polls when inotify is not available
+
+class DTAFollower:
+	def __init__(self, filename, max_time = None):
+		self.filename = filename
+		self.max_time = max_time #stop following once a row reaches this time
+		self.reset()
+
+	#forget everything read so far, e.g. when the file is replaced
+	def reset(self):
+		self.offset = 0 #number of bytes consumed from the file
+		self.header_lines = []
+		self.header = None
+		self.columns = (2, 3)
+		self.skip = 0 #column-name and unit rows still to skip under the data tag
+		self.times = []
+		self.voltages = []
+		self.rows = 0
+		self.finished = False
+
+	#read the newly appended complete lines, or an empty list if there are none
+	def _new_lines(self):
+		try:
+			size = os.path.getsize(self.filename)
+		except OSError:
+			return [] #not created yet
+		if size < self.offset:
+			self.reset() #file was truncated or replaced
+		if size == self.offset:
+			return []
+		with open(self.filename, 'rb') as f:
+			f.seek(self.offset)
+			chunk = f.read(size - self.offset)
+		end = chunk.rfind(b'\n')
+		if end < 0:
+			return [] #only part of a row so far
+		self.offset += end + 1
+		return chunk[:end].decode(errors = 'replace').split('\n')
+
+	#parse new data and return the (time, voltage) rows appended since the last poll.
+	#Raises DTAFormatError for a file that is not a measurement we can read.
+	def poll(self):
+		if self.finished:
+			return np.empty(0), np.empty(0)
+		try:
+			return self._poll()
+		except DTAFormatError as error:
+			raise DTAFormatError('%s: %s' % (self.filename, error)) from None
+
+	def _poll(self):
+		new_rows = []
+		for line in self._new_lines():
+			if self.header is None:
+				self.header_lines.append(line)
+				if line.startswith(data_tag + '\t'):
+					self.header = parse_header(self.header_lines)
+					self.skip = 2
+				elif len(self.header_lines) > max_header_lines:
+					parse_header(self.header_lines) #raises for the missing data table
+				continue
+			if self.skip:
+				if self.skip == 2:
+					self.columns = column_indices(line)
+				self.skip -= 1
+				continue
+			if not line.startswith('\t'):
+				self.finished = True #end marker: a tagged line after the data table
+				break
+			new_rows.append(line)
+		times, voltages = parse_rows(new_rows, self.columns)
+		if self.max_time is not None and len(times) and times[-1] >= self.max_time:
+			self.finished = True
+		self.times.append(times)
+		self.voltages.append(voltages)
+		self.rows += len(times)
+		if self.header is not None and self.header.points is not None and self.rows >= self.header.points:
+			self.finished = True
+		return times, voltages
+
+	#everything read so far as (header, time, voltage)
+	def result(self):
+		return self.header, np.concatenate(self.times or [np.empty(0)]), np.concatenate(self.voltages or [np.empty(0)])
+
+#block until the file or its folder changes, or timeout seconds pass
+class _Waiter:
+	def __init__(self, filename):
+		self.inotify = None
+		if INotify is not None:
+			self.inotify = INotify()
+			folder = os.path.dirname(os.path.abspath(filename))
+			self.inotify.add_watch(folder, flags.MODIFY | flags.CREATE | flags.MOVED_TO | flags.CLOSE_WRITE)
+
+	def wait(self, timeout):
+		if self.inotify is None:
+			time.sleep(timeout)
+		else:
+			self.inotify.read(timeout = int(timeout*1000))
+
+	def close(self):
+		if self.inotify is not None:
+			self.inotify.close()
+
+#follow a .DTA file until the measurement is finished and return (header, time, voltage).
+#A measurement is finished once the point count from the header has been read, an end
+#marker appears, or (if given) max_time is reached. If no new rows arrive for idle_time
+#seconds after the data table has started, the run is taken to have ended early.
+def follow_dta(filename, max_time = None, idle_time = None, interval = None):
+	follower = DTAFollower(filename, max_time)
+	waiter = _Waiter(filename)
+	interval = interval or poll_interval
+	last_change = time.monotonic()
+	try:
+		while True:
+			offset = follower.offset
+			follower.poll()
+			if follower.finished:
+				break
+			if follower.offset != offset:
+				last_change = time.monotonic()
+			elif idle_time is not None and follower.rows and time.monotonic() - last_change > idle_time:
+				break
+			waiter.wait(interval)
+	finally:
+		waiter.close()
+	return follower.result()
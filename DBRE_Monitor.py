@@ -0,0 +1,157 @@
+import os
+import time
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from DBRE_Analysis import AnalysisParams, analyze_measurement, measurement_file
+from DBRE_Follow import DTAFollower
+from DBRE_Reader import DTAFormatError
+from DBRE_Store import SummaryStore
+from DBRE_Timeline import PotentialTimeline
+from DBRE_Export import resolve_sink, write_raw
+from DBRE_SummaryPlot import SummaryPlot
+from DBRE_Render import render, trace_job
+from DBRE_Profile import enable_profiling, measurement_profile, stage
+
+# Live monitoring of many DBRE cells from one process. Each experiment folder is followed
+# by its own asyncio task, so a folder waiting on its next file does not hold up the others.
+# Finished measurements are analyzed, plotted and saved in a process pool, and their result
+# is printed and added to the folder's summary store as soon as it is done. Stop with Ctrl-C.
+#	python DBRE_Monitor.py [folder ...] [--jobs N]
+# Without folders, every subfolder holding A_DBRE_#1.DTA is followed, and new ones are picked up.
+
+# The following inputs will need to be set based on the experiment DBRE configuration #
+start_time = datetime(2020, 10, 27, 15, 0, 0) #start of experiment
+cycle_time = 1 #seconds between checks of a file that is being written
+reset_time = 10000 #seconds without new rows after which a partly written file is taken as finished
+scan_time = 60 #seconds between looks for new experiment folders
+max_time = 600 #do not plot or evaluate past this number of seconds, to reduce amount of data
+slope_threshold = 0.008 #default max value for slope of plateau
+con_threshold = 0.001 #default max value for second derivative of plateau
+min_plateau_length = 15 #minimum number of points needed to have a plateau
+derivative_window = 21 #points in the local polynomial fits giving the smoothed derivative and concavity, where each point is 0.1 s apart
+spline_smoothing = None #smoothing of a spline of voltage over time used for the concavity instead, e.g. 0.0005 with derivative_window = None
+printplots = True #whether or not you'd like to print each plot and the summary plots
+raw_export = 'feather' #format of the raw data saved for each measurement: 'none', 'npz', 'parquet', 'feather' or 'xlsx' (slow)
+retry = True #whether to try reducing threshold if no plateau detected
+threshold_grid = None #(slope, concavity, min length) thresholds to try in order when retrying, None for slope/5, concavity/3, length/1.5
+profile = False #whether to record the time taken by each stage of each measurement in DBRE_Profile.jsonl
+profile_memory = False #whether to also record peak memory, which slows the analysis down
+jobs = None #number of worker processes, None for one per CPU
+
+#analyze one measurement that has been read, save its raw data and plot it. Runs in a worker process.
+def process_measurement(filename, header, times, voltages, params, printplots, raw_export):
+	with measurement_profile(filename):
+		measurement = analyze_measurement(header, times, voltages, params)
+		with stage('export'):
+			write_raw(measurement.raw_data, filename[:-4], raw_export)
+		if printplots:
+			with stage('plot'):
+				render(trace_job(filename, measurement, 'batch', params.max_time))
+	return measurement.summary
+
+#follow a file without blocking the other folders, and return (header, time, voltage) once it is finished.
+#Returns None if the file is not there while the next measurement is, i.e. it was skipped.
+async def follow_file(filename, next_filename):
+	follower = DTAFollower(filename, max_time)
+	last_change = time.monotonic()
+	while True:
+		offset = follower.offset
+		follower.poll()
+		if follower.finished:
+			break
+		if follower.offset != offset:
+			last_change = time.monotonic()
+		elif follower.rows and time.monotonic() - last_change > reset_time:
+			break
+		elif follower.offset == 0 and os.path.isfile(next_filename) and not os.path.isfile(filename):
+			return None
+		await asyncio.sleep(cycle_time)
+	return follower.result()
+
+#follow the measurements of one folder in order, starting after the last one in its summary store.
+#A measurement that fails for another reason than its analysis or its file, e.g. a store that cannot be
+#written for now, is tried again after cycle_time. Summary plots are saved on plot_saver, off the event loop.
+async def watch_folder(folder, executor, plot_saver, params, sink):
+	loop = asyncio.get_running_loop()
+	store = SummaryStore(folder)
+	timeline = PotentialTimeline(folder)
+	timeline.sync(folder)
+	done = store.read()
+	number = int(done.Measurement.max()) + 1 if len(done) else 1
+	summary_plot = None
+	if printplots:
+		summary_plot = SummaryPlot(os.path.join(folder, 'DBRE_Summary.png'))
+		summary_plot.add_frame(done)
+	print('following %s from measurement #%d' % (folder, number))
+	try:
+		while True:
+			filename = measurement_file(folder, number)
+			try:
+				data = await follow_file(filename, measurement_file(folder, number + 1))
+				if data is not None and len(data[1]):
+					header, times, voltages = data
+					try:
+						summary = await loop.run_in_executor(executor, partial(process_measurement, filename, header, times, voltages, params, printplots, sink))
+					except Exception as error:
+						print('%s: analysis failed: %r' % (filename, error))
+					else:
+						store.append(number, summary)
+						timeline.add(folder, number, summary)
+						print('%s #%d %s %s: %.4f +- %.4f V' % (folder, number, summary['Date'], summary['Time'], summary['Potential'], summary['Uncertainty']))
+						if summary_plot is not None:
+							summary_plot.put(number, summary)
+							if summary_plot.due():
+								await loop.run_in_executor(plot_saver, summary_plot.save, summary_plot.preview_dpi)
+			except DTAFormatError as error:
+				print('skipped %s' % error)
+			except Exception as error:
+				print('%s: %r, trying again in %g s' % (filename, error, cycle_time))
+				await asyncio.sleep(cycle_time)
+				continue
+			number += 1
+	finally:
+		if summary_plot is not None:
+			plot_saver.submit(summary_plot.close).result() #after a save that is still running
+		timeline.close()
+		store.close()
+
+#folders to follow: the ones given, or every subfolder with a first measurement
+def find_folders(folders):
+	if folders:
+		return folders
+	return sorted(d.path for d in os.scandir('.') if d.is_dir() and os.path.isfile(measurement_file(d.path, 1)))
+
+#follow every folder at once, starting a task for each new folder that shows up, and again for a folder whose task stopped
+async def monitor(folders, jobs):
+	params = AnalysisParams(start_time, max_time, slope_threshold, con_threshold, min_plateau_length, spline_smoothing, retry, derivative_window, threshold_grid = threshold_grid)
+	sink = resolve_sink(raw_export)
+	tasks = {}
+	#the workers analyze the measurements, so they are the ones that profile them
+	#summary plots of all folders are saved one at a time, on a thread of their own
+	with ProcessPoolExecutor(jobs, initializer = enable_profiling if profile else None, initargs = ('.', profile_memory)) as executor, ThreadPoolExecutor(1) as plot_saver:
+		try:
+			while True:
+				for folder in find_folders(folders):
+					task = tasks.get(folder)
+					if task is not None and task.done():
+						print('%s: stopped: %r, following it again' % (folder, task.exception()))
+					if task is None or task.done():
+						tasks[folder] = asyncio.create_task(watch_folder(folder, executor, plot_saver, params, sink))
+				await asyncio.sleep(scan_time)
+		finally:
+			for task in tasks.values():
+				task.cancel()
+			await asyncio.gather(*tasks.values(), return_exceptions = True)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument('folders', nargs = '*', help = 'experiment folders to follow, all subfolders if none are given')
+	parser.add_argument('--jobs', type = int, default = jobs, help = 'number of worker processes')
+	args = parser.parse_args()
+	try:
+		asyncio.run(monitor(args.folders, args.jobs))
+	except KeyboardInterrupt:
+		pass
@@ -0,0 +1,219 @@
+import numpy as np
+
+# Plateau detection on whole arrays. Each function takes a single trace, or a 2-D batch
+# of equal-length traces (one per row) and then returns an array of starts and ends.
+# The results match the original loops over raw_data.Derivative and raw_data.Concavity,
+# which are kept below as slope_plateau_loop and concavity_plateau_loop. Running this
+# file checks the two against each other:
+#	python DBRE_Plateau.py
+
+#index of the first True along the last axis, or default where there is none
+def _first_true(mask, default):
+	if mask.shape[-1] == 0:
+		return np.full(mask.shape[:-1], default)
+	return np.where(mask.any(axis = -1), mask.argmax(axis = -1), default)
+
+#(start, end) of the plateau given masks of the points inside it and the points that can end it.
+#For a batch, min_length can also be given per row.
+#The loops set the start at the first inside point and only move it if that point was index 0;
+#they stop at the first ending point that comes after an inside point and is more than
+#min_length points past the start, or run to the last point otherwise.
+def find_plateau(inside, ending, min_length):
+	inside = np.asarray(inside, dtype = bool)
+	ending = np.asarray(ending, dtype = bool)
+	n = inside.shape[-1]
+	reached = np.logical_or.accumulate(inside, axis = -1)
+	first = _first_true(inside[..., 1:], n - 1) + 1 #first inside point after index 0, n if none
+	index = np.arange(n)
+	start = np.where(index >= first[..., None], first[..., None], 0) #start as the loop sees it at each point
+	stop = ending & reached & (index - start > np.asarray(min_length)[..., None])
+	end = _first_true(stop, max(n - 1, 0))
+	start = np.where(first <= end, first, 0)
+	if start.ndim == 0:
+		return int(start), int(end)
+	return start, end
+
+#plateau where the first derivative stays below threshold
+def slope_plateau(derivative, threshold, min_length):
+	derivative = np.asarray(derivative, dtype = np.float64)
+	return find_plateau(derivative < threshold, derivative > threshold, min_length)
+
+#plateau where the concavity stays within +-threshold
+def concavity_plateau(concavity, threshold, min_length):
+	concavity = np.asarray(concavity, dtype = np.float64)
+	return find_plateau(np.abs(concavity) < threshold, concavity > threshold, min_length)
+
+#tightest of the two plateaus: the slope plateau if it ends first, otherwise the concavity plateau
+def tightest_plateau(slope, concavity):
+	use_slope = np.asarray(slope[1]) < np.asarray(concavity[1])
+	start = np.where(use_slope, slope[0], concavity[0])
+	end = np.where(use_slope, slope[1], concavity[1])
+	if start.ndim == 0:
+		return int(start), int(end)
+	return start, end
+
+#plateau found from the derivative, and from the concavity if a threshold is given
+def detect_plateau(derivative, concavity, slope_threshold, con_threshold, min_length):
+	slope = slope_plateau(derivative, slope_threshold, min_length)
+	if con_threshold is None:
+		return slope
+	return tightest_plateau(slope, concavity_plateau(concavity, con_threshold, min_length))
+
+#plateaus of one trace for each (slope_threshold, con_threshold, min_length) candidate, as arrays
+#of starts and ends. con_threshold can be None to only use the slope. The derivative and concavity
+#are shared, so all candidates are found together with a few batched array operations.
+def sweep_plateau(derivative, concavity, candidates):
+	derivative = np.asarray(derivative, dtype = np.float64)
+	concavity = np.asarray(concavity, dtype = np.float64)
+	slope_thresholds = np.array([c[0] for c in candidates], dtype = np.float64)[:, None]
+	min_lengths = np.array([c[2] for c in candidates], dtype = np.float64)
+	starts, ends = find_plateau(derivative < slope_thresholds, derivative > slope_thresholds, min_lengths)
+	with_con = np.array([c[1] is not None for c in candidates])
+	if with_con.any():
+		con_thresholds = np.array([c[1] for c in candidates if c[1] is not None], dtype = np.float64)[:, None]
+		con = find_plateau(np.abs(concavity) < con_thresholds, concavity > con_thresholds, min_lengths[with_con])
+		starts[with_con], ends[with_con] = tightest_plateau((starts[with_con], ends[with_con]), con)
+	return starts, ends
+
+#online version of slope_plateau or concavity_plateau: values are fed in order, a chunk at a time,
+#and feed returns True as soon as the plateau has ended. The plateau is then the one that
+#slope_plateau/concavity_plateau find on the values fed so far, so reading can stop there.
+class PlateauTracker:
+	def __init__(self, threshold, min_length, concavity = False):
+		self.threshold = threshold
+		self.min_length = min_length
+		self.concavity = concavity
+		self.count = 0 #values fed so far
+		self.reached = False #whether a value inside the plateau has been seen
+		self.start = 0 #start as the loops see it, stays at 0 until an inside point after index 0
+		self.end = None #index of the value that ended the plateau
+
+	def feed(self, values):
+		if self.end is not None:
+			return True
+		values = np.asarray(values, dtype = np.float64)
+		if self.concavity:
+			inside, ending = np.abs(values) < self.threshold, values > self.threshold
+		else:
+			inside, ending = values < self.threshold, values > self.threshold
+		index = self.count + np.arange(len(values))
+		start = np.full(len(values), self.start)
+		if self.start == 0:
+			first = _first_true(inside & (index >= 1), len(values))
+			start[first:] = index[first] if first < len(values) else 0
+		reached = self.reached | np.logical_or.accumulate(inside)
+		stop = _first_true(ending & reached & (index - start > self.min_length), len(values))
+		if stop < len(values):
+			self.end = int(index[stop])
+			self.start = int(start[stop])
+			return True
+		self.count += len(values)
+		if len(values):
+			self.reached = bool(reached[-1])
+			self.start = int(start[-1])
+		return False
+
+#online version of detect_plateau: the derivative and concavity are fed in order, a chunk at a time,
+#and feed returns True once the plateau is known, i.e. detect_plateau finds the same plateau on the
+#values fed so far as on the whole trace. A tracker that has not ended ends at the last value fed,
+#which would tie with one that ended there, so the plateau is only known once a value past its end is in.
+class PlateauDetector:
+	def __init__(self, slope_threshold, con_threshold, min_length):
+		self.trackers = [PlateauTracker(slope_threshold, min_length)]
+		if con_threshold is not None:
+			self.trackers.append(PlateauTracker(con_threshold, min_length, concavity = True))
+		self.count = 0 #values fed so far
+
+	def feed(self, derivative, concavity):
+		for tracker in self.trackers:
+			tracker.feed(concavity if tracker.concavity else derivative)
+		self.count += len(derivative)
+		return any(tracker.end is not None and tracker.end < self.count - 1 for tracker in self.trackers)
+
+#original loop: go through readings until derivative exceeds threshold
+def slope_plateau_loop(derivative, threshold, min_length):
+	reached_plateau = False
+	plateau_start = 0
+	count = -1
+	for i in derivative:
+		count = count + 1
+		if i < threshold:
+			reached_plateau = True #make sure that initial steepness is ignored
+			if plateau_start == 0:
+				plateau_start = count
+		if i > threshold and reached_plateau is True and abs(count-plateau_start) > min_length: #end loop
+			break
+	return plateau_start, max([count,0])
+
+#original loop: detect plateau based on concavity
+def concavity_plateau_loop(concavity, threshold, min_length):
+	reached_plateau = False
+	plateau_start = 0
+	count = -1
+	for i in concavity:
+		count = count + 1
+		if i > -threshold and abs(i) < threshold:
+			reached_plateau = True
+			if plateau_start == 0:
+				plateau_start = count
+		if i > threshold and reached_plateau == True and abs(count-plateau_start) > min_length:
+			break
+	return plateau_start, max([count,0])
+
+#compare the vectorized functions with the loops on random and edge-case traces
+def check_parity(traces = 2000, seed = 0):
+	rng = np.random.default_rng(seed)
+	cases = [np.empty(0), np.zeros(1), np.ones(5), np.full(30, 0.001), np.array([0.0, 0.02, 0.0, 0.0, 0.02]), np.array([np.nan, 0.0, 0.02])]
+	for i in range(traces):
+		n = int(rng.integers(1, 200))
+		trace = rng.normal(0.005, 0.006, n)
+		trace[rng.random(n) < 0.05] = 0.008 #values equal to the threshold
+		cases.append(trace)
+	for trace in cases:
+		for min_length in (0, 3, 10, 15/1.5):
+			assert slope_plateau(trace, 0.008, min_length) == slope_plateau_loop(trace, 0.008, min_length)
+			assert concavity_plateau(trace - 0.005, 0.001, min_length) == concavity_plateau_loop(trace - 0.005, 0.001, min_length)
+	#2-D batches give the same answer as each row on its own
+	batch = rng.normal(0.005, 0.006, (50, 120))
+	starts, ends = slope_plateau(batch, 0.008, 10)
+	assert [slope_plateau_loop(row, 0.008, 10) for row in batch] == list(zip(starts, ends))
+	con_starts, con_ends = concavity_plateau(batch - 0.005, 0.001, 10)
+	assert [concavity_plateau_loop(row - 0.005, 0.001, 10) for row in batch] == list(zip(con_starts, con_ends))
+	#a sweep gives the same plateaus as detecting each candidate on its own
+	candidates = [(0.008, None, 10), (0.0016, 0.001, 10/1.5), (0.008, 0.002, 3)]
+	for trace in cases[:200]:
+		starts, ends = sweep_plateau(trace, trace - 0.005, candidates)
+		assert list(zip(starts, ends)) == [detect_plateau(trace, trace - 0.005, *c) for c in candidates]
+	#the tracker stops where the loops break, fed in chunks of any size
+	for trace in cases:
+		for concavity, loop in ((False, slope_plateau_loop), (True, concavity_plateau_loop)):
+			values = trace - 0.005 if concavity else trace
+			threshold = 0.001 if concavity else 0.008
+			tracker = PlateauTracker(threshold, 10, concavity)
+			i = 0
+			while i < len(values) and not tracker.feed(values[i:i + int(rng.integers(1, 20))]):
+				i = tracker.count
+			start, end = loop(values, threshold, 10)
+			if tracker.end is None:
+				assert end == max(len(values) - 1, 0) #the loop ran to the last value without breaking
+			else:
+				assert (tracker.start, tracker.end) == (start, end)
+	#the plateau is the same on the values fed until the detector knows it as on the whole trace,
+	#fed one value at a time (where an end on the last value fed would tie) or in chunks of any size
+	for trace in cases:
+		for con_threshold in (None, 0.001):
+			full = detect_plateau(trace, trace - 0.005, 0.008, con_threshold, 10)
+			for chunk in (1, None):
+				detector = PlateauDetector(0.008, con_threshold, 10)
+				i = 0
+				while i < len(trace):
+					step = chunk or int(rng.integers(1, 20))
+					i += step
+					if detector.feed(trace[i - step:i], trace[i - step:i] - 0.005):
+						break
+				fed = trace[:detector.count]
+				assert detect_plateau(fed, fed - 0.005, 0.008, con_threshold, 10) == full
+	return len(cases)
+
+if __name__ == '__main__':
+	print('%d traces match the loop version' % check_parity())
@@ -0,0 +1,21 @@
+import os
+import sys
+
+# Matplotlib is only imported once something is actually plotted, so runs without plots
+# start quickly. The scripts only save images, so the Agg backend is used when there is
+# no display to draw to (unless MPLBACKEND says otherwise).
+
+#whether there is no display, e.g. when run from cron or over ssh
+def headless():
+	if sys.platform.startswith('win') or sys.platform == 'darwin':
+		return False
+	return not os.environ.get('DISPLAY') and not os.environ.get('WAYLAND_DISPLAY')
+
+#matplotlib.pyplot, imported on first use
+def pyplot():
+	if 'matplotlib.pyplot' not in sys.modules:
+		import matplotlib
+		if headless() and 'MPLBACKEND' not in os.environ:
+			matplotlib.use('Agg')
+	import matplotlib.pyplot as plt
+	return plt
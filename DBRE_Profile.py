@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import threading
+import tracemalloc
+from contextlib import nullcontext
+
+# Timing of the stages of each measurement. The analysis wraps its stages in
+# `with stage('name'):` and each measurement in `with measurement_profile(filename):`.
+# Once the measurement is done, its record is passed to every collector:
+#	{'measurement': filename, 'start': unix time, 'seconds': total, 'peak_bytes': ...,
+#	 'stages': [{'stage': name, 'seconds': ..., 'peak_bytes': ...}, ...]}
+# Without collectors the context managers do nothing, so leaving them in costs next to
+# nothing. Stages can be nested, and each is listed when it ends. peak_bytes is only
+# recorded when memory tracking is on, as tracemalloc slows everything down; it is the
+# peak of traced memory in use while the stage ran.
+# Each thread profiles its own measurement. Work handed to a background thread or process
+# (RawWriter, PlotRenderer) is recorded there, in a record of its own for the same measurement,
+# and the stage that handed it over only times the hand-over. Memory peaks are those of the
+# whole process, so they overlap while several threads are profiling.
+
+profile_name = 'DBRE_Profile.jsonl'
+
+collectors = [] #functions called with the record of each measurement
+_state = threading.local() #record: of the measurement being profiled, stages: running now, innermost last
+
+def add_collector(collector):
+	collectors.append(collector)
+
+def remove_collector(collector):
+	collectors.remove(collector)
+
+#writes each record as one line of JSON
+class JsonLinesCollector:
+	def __init__(self, filename):
+		self.filename = filename
+
+	def __call__(self, record):
+		#opened for each record, so that worker processes can add to the same file
+		with open(self.filename, 'a') as f:
+			f.write(json.dumps(record) + '\n')
+
+#record stage timings of every measurement in DBRE_Profile.jsonl in folder, with peak memory if memory is set.
+#Returns the collector, to be given to remove_collector when done. Can be given as the initializer of
+#a process pool: a worker that already has the collector, e.g. when forked, keeps only the one.
+def enable_profiling(folder = '.', memory = False):
+	filename = os.path.abspath(os.path.join(folder, profile_name))
+	collector = next((c for c in collectors if isinstance(c, JsonLinesCollector) and c.filename == filename), None)
+	if collector is None:
+		collector = JsonLinesCollector(filename)
+		add_collector(collector)
+	if memory and not tracemalloc.is_tracing():
+		tracemalloc.start()
+	return collector
+
+def _peak():
+	return tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+
+class _Stage:
+	def __init__(self, name):
+		self.name = name
+
+	def __enter__(self):
+		self.inner_peak = 0 #peak of the stages inside this one, whose start reset the peak
+		if tracemalloc.is_tracing():
+			tracemalloc.reset_peak()
+		_state.stages.append(self)
+		self.start = time.perf_counter()
+
+	def __exit__(self, *exc):
+		seconds = time.perf_counter() - self.start
+		stages, record = _state.stages, _state.record
+		stages.pop()
+		peak = _peak()
+		if peak is not None:
+			peak = max(peak, self.inner_peak)
+			if stages:
+				stages[-1].inner_peak = max(stages[-1].inner_peak, peak)
+		if record is not None:
+			record['stages'].append({'stage': self.name, 'seconds': seconds, 'peak_bytes': peak})
+			if peak is not None:
+				record['peak_bytes'] = max(record['peak_bytes'] or 0, peak)
+
+class _Measurement:
+	def __init__(self, name):
+		self.name = name
+
+	def __enter__(self):
+		_state.record = {'measurement': self.name, 'start': time.time(), 'seconds': None, 'peak_bytes': None, 'stages': []}
+		_state.stages = []
+		if tracemalloc.is_tracing():
+			tracemalloc.reset_peak()
+		self.start = time.perf_counter()
+
+	def __exit__(self, *exc):
+		record, _state.record = _state.record, None
+		record['seconds'] = time.perf_counter() - self.start
+		if tracemalloc.is_tracing():
+			record['peak_bytes'] = max(record['peak_bytes'] or 0, _peak())
+		for collector in collectors:
+			collector(record)
+
+_null = nullcontext()
+
+#name of the measurement this thread is profiling, or None, e.g. for work handed to a background thread
+def current_measurement():
+	record = getattr(_state, 'record', None)
+	return record['measurement'] if record is not None else None
+
+#context timing one stage of the measurement being profiled
+def stage(name):
+	if getattr(_state, 'record', None) is None:
+		return _null
+	return _Stage(name)
+
+#context profiling one measurement, whose record goes to the collectors at the end
+def measurement_profile(name):
+	if not collectors:
+		return _null
+	return _Measurement(name)
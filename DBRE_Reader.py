@@ -0,0 +1,173 @@
+import numpy as np
+from collections import namedtuple
+from datetime import datetime
+
+# Shared reader for Gamry .DTA files. Each file is opened and read once; the header
+# and the data table are split apart in memory instead of being read in two passes.
+# Header values are found by their tags rather than by line number, as the header length
+# depends on the instrument setup. A file that cannot be read as a measurement raises
+# DTAFormatError, while a file that is still being written just has no rows yet.
+
+data_tag = 'CURVE' #tag of the header line that opens the data table
+time_column = 'T' #name of the time column in the data table
+voltage_column = 'Vf' #name of the voltage column in the data table
+charging_tag = 'TSTEP1' #tag of the charging step time
+required_tags = ['DATE', 'TIME', charging_tag] #tags every measurement header has
+template_lines = 2 #first header lines naming the instrument template, e.g. 'TAG	CHRONOP'
+max_header_lines = 1000 #a file without a data table in this many lines is not a measurement
+
+DTAHeader = namedtuple('DTAHeader', ['date', 'time', 'datetime', 'charging_time', 'points', 'tags'])
+
+#line numbers of the tags and of the data table in the header of one instrument template.
+#data_start is None while the data table has not been written.
+DTALayout = namedtuple('DTALayout', ['data_start', 'tag_lines'])
+layouts = {} #layouts seen for each template, by its first template_lines lines
+
+class DTAFormatError(ValueError):
+	pass
+
+#value column of a tab separated header line, or None if the line is too short
+def _field(line):
+	fields = line.split('\t')
+	if len(fields) < 3:
+		return None
+	return fields[2].strip()
+
+#whether the header lines have every tag of layout on its line
+def _matches(layout, lines):
+	if layout.data_start >= len(lines):
+		return False
+	return all(lines[i].partition('\t')[0] == tag for tag, i in layout.tag_lines.items())
+
+#find the tags and the data table of a header. The header length differs between instrument
+#setups (e.g. with the number of note lines), so the layout of each template is kept and only
+#checked against the next file of that template; the lines are scanned again if it does not match.
+def index_header(lines):
+	key = tuple(lines[:template_lines])
+	for layout in layouts.get(key, []):
+		if _matches(layout, lines):
+			return layout
+	tag_lines = {}
+	for i, line in enumerate(lines[:max_header_lines]):
+		tag = line.partition('\t')[0]
+		if tag and tag not in tag_lines:
+			tag_lines[tag] = i
+		if tag == data_tag:
+			layout = DTALayout(i, tag_lines)
+			layouts.setdefault(key, []).append(layout)
+			return layout
+	if len(lines) > max_header_lines:
+		raise DTAFormatError('no %s data table in the first %d lines' % (data_tag, max_header_lines))
+	return DTALayout(None, tag_lines)
+
+#build the typed header from the lines above the data table. Once the data table is reached
+#the header is complete, so a missing date, time or charging time is an error.
+def parse_header(lines):
+	layout = index_header(lines)
+	tags = {tag: _field(lines[i]) for tag, i in layout.tag_lines.items()}
+	if layout.data_start is not None:
+		missing = [tag for tag in required_tags if not tags.get(tag)]
+		if missing:
+			raise DTAFormatError('no %s in the header' % ', '.join(missing))
+	try:
+		points = int(tags[data_tag]) if tags.get(data_tag) else None
+		datestamp = tags.get('DATE')
+		timestamp = tags.get('TIME')
+		datetimestamp = None
+		if datestamp and timestamp:
+			datetimestamp = datetime.strptime(datestamp + ' ' + timestamp, '%m/%d/%Y %H:%M:%S')
+		charging_time = float(tags[charging_tag]) if tags.get(charging_tag) else None
+	except ValueError as error:
+		raise DTAFormatError('bad header: %s' % error) from None
+	return DTAHeader(datestamp, timestamp, datetimestamp, charging_time, points, tags)
+
+#column numbers of time and voltage from the column-name row under the data tag
+def column_indices(names_line):
+	names = names_line.rstrip('\r\n').split('\t')
+	if time_column in names and voltage_column in names:
+		return names.index(time_column), names.index(voltage_column)
+	raise DTAFormatError('no %s and %s columns in the data table' % (time_column, voltage_column))
+
+#convert complete data rows into float64 time and voltage arrays
+def parse_rows(rows, columns = (2, 3)):
+	if not rows:
+		return np.empty(0), np.empty(0)
+	try:
+		data = np.loadtxt(rows, delimiter = '\t', usecols = columns, dtype = np.float64, ndmin = 2)
+	except ValueError as error:
+		raise DTAFormatError('bad data row: %s' % error) from None
+	return data[:, 0], data[:, 1]
+
+#split the text of a .DTA file into header lines, data column numbers and data rows.
+#rows is empty while the data table has not been written yet.
+def split_dta(text):
+	lines = text.split('\n')
+	lines.pop() #either empty, or a row that is still being written
+	data_start = index_header(lines).data_start
+	if data_start is None or len(lines) <= data_start + 1:
+		return lines, (2, 3), []
+	columns = column_indices(lines[data_start + 1])
+	#skip the tag, column-name and unit rows, and stop at the first line after the data table
+	rows = lines[data_start + 3:]
+	end = next((i for i, line in enumerate(rows) if not line.startswith('\t')), len(rows))
+	rows = rows[:end]
+	return lines[:data_start + 1], columns, rows
+
+#read a .DTA file once and return (header, time, voltage).
+#Raises DTAFormatError for a file that is not a measurement we can read.
+def read_dta(filename):
+	with open(filename, 'r', errors = 'replace') as f:
+		text = f.read()
+	try:
+		header_lines, columns, rows = split_dta(text)
+		header = parse_header(header_lines)
+		time, voltage = parse_rows(rows, columns)
+	except DTAFormatError as error:
+		raise DTAFormatError('%s: %s' % (filename, error)) from None
+	return header, time, voltage
+
+#open a .DTA file and return (header, chunks), where chunks yields (time, voltage) arrays of up to
+#chunk_rows rows at a time. Rows are only read and parsed as the chunks are taken, so a caller
+#that stops early does not pay for the rest of the file. The file is closed once chunks is done.
+#Raises DTAFormatError like read_dta, from chunks for errors in the data rows.
+def stream_dta(filename, chunk_rows = 500):
+	f = open(filename, 'r', errors = 'replace')
+	header_lines = []
+	columns = None #until the column-name row has been written
+	try:
+		for line in f:
+			header_lines.append(line.rstrip('\r\n'))
+			if line.startswith(data_tag + '\t'):
+				names = next(f, '')
+				if names.endswith('\n'):
+					columns = column_indices(names)
+				next(f, '') #unit row
+				break
+			if len(header_lines) > max_header_lines:
+				break
+		header = parse_header(header_lines)
+	except DTAFormatError as error:
+		f.close()
+		raise DTAFormatError('%s: %s' % (filename, error)) from None
+
+	def chunks():
+		with f:
+			if columns is None:
+				return
+			rows = []
+			for line in f:
+				if not line.startswith('\t') or not line.endswith('\n'):
+					break #end of the data table, or a row that is still being written
+				rows.append(line)
+				if len(rows) == chunk_rows:
+					yield _parse_chunk(filename, rows, columns)
+					rows = []
+			if rows:
+				yield _parse_chunk(filename, rows, columns)
+	return header, chunks()
+
+def _parse_chunk(filename, rows, columns):
+	try:
+		return parse_rows(rows, columns)
+	except DTAFormatError as error:
+		raise DTAFormatError('%s: %s' % (filename, error)) from None
@@ -0,0 +1,159 @@
+import os
+import sys
+import queue
+import pickle
+import threading
+import subprocess
+import numpy as np
+from contextlib import nullcontext
+from DBRE_Profile import JsonLinesCollector, add_collector, collectors, current_measurement, measurement_profile, stage
+
+# Rendering of the per-measurement discharge plots. A figure is built once per layout and
+# process, and each trace only updates its line data, markers and limits before saving.
+# PlotRenderer hands the plots to a separate rendering process, fed from a queue by a
+# background thread, so that analysis never waits on matplotlib. Thumbnails are small,
+# low resolution plots for bulk archives.
+# The layouts are the plots of the scripts: 'live' (voltage and derivative, DBRE_Script.py)
+# and 'batch' (voltage, derivative and concavity zoomed on the plateau, DBRE_Script_Glob.py).
+
+dpi = 300
+thumbnail_dpi = 100
+thumbnail_size = (3.2, 2.4) #inches
+
+#everything needed to draw one measurement, as plain values that can be sent to another process.
+#The voltage is drawn from spline when it is given.
+def trace_job(filename, measurement, layout, max_time, thumbnail = False):
+	raw_data = measurement.raw_data
+	trace = measurement.trace
+	curve = raw_data.Voltage.to_numpy()
+	if measurement.spline is not None:
+		import scipy.interpolate
+		curve = scipy.interpolate.splev(raw_data.Time, measurement.spline)
+	from DBRE_Analysis import measurement_number #loaded by the analysis already, kept out of the rendering process
+	number = str(measurement_number(filename))
+	marks = [measurement.plateau_start, measurement.plateau_end]
+	return {'layout': layout, 'max_time': max_time, 'thumbnail': thumbnail,
+		'number': number, 'output': os.path.join(os.path.dirname(filename), 'plot#' + number + '.png'),
+		'time': raw_data.Time.to_numpy(), 'voltage': curve, 'derivative': raw_data.Derivative.to_numpy(), 'concavity': raw_data.Concavity.to_numpy(),
+		'voltage_range': (raw_data.Voltage.min(), raw_data.Voltage.iloc[-1] + 0.05),
+		'marks': {column: trace[column].to_numpy()[marks] for column in ['Time', 'Voltage', 'Derivative', 'Concavity']},
+		'slope_threshold': measurement.slope_threshold, 'con_threshold': measurement.con_threshold}
+
+#figure of one layout, with the artists that change from trace to trace
+class TracePlot:
+	def __init__(self, layout, max_time, thumbnail = False):
+		from matplotlib.figure import Figure
+		from matplotlib.backends.backend_agg import FigureCanvasAgg
+		self.layout = layout
+		self.max_time = max_time
+		self.figure = Figure(figsize = thumbnail_size if thumbnail else None)
+		FigureCanvasAgg(self.figure)
+		self.dpi = thumbnail_dpi if thumbnail else dpi
+		self.title = self.figure.suptitle('')
+		if layout == 'live':
+			top, mid = self.figure.subplots(2, 1)
+			self.axes = {'Voltage': top, 'Derivative': mid}
+			mid.set_xlabel('Time (s)')
+			mid.set_ylabel('First Derivative (V/s)')
+		else:
+			top, mid, bottom = self.figure.subplots(3, 1, sharex = True)
+			self.figure.subplots_adjust(hspace = .07)
+			self.axes = {'Voltage': top, 'Derivative': mid, 'Concavity': bottom}
+			mid.set_ylabel('Derivative')
+			bottom.set_xlabel('Time (s)')
+			bottom.set_ylabel('Concavity')
+		top.set_ylabel('Voltage (V)')
+		self.lines = {column: ax.plot([], [])[0] for column, ax in self.axes.items()}
+		self.marks = {column: ax.plot([], [], 'or', markersize = 6)[0] for column, ax in self.axes.items()}
+		self.thresholds = [mid.axhline(0, linestyle = 'dashed', color = 'C0')]
+		if layout != 'live':
+			self.thresholds += [bottom.axhline(0, linestyle = 'dashed', color = 'C0'), bottom.axhline(0, linestyle = 'dashed', color = 'C0')]
+
+	#draw a trace_job into the figure and save it
+	def draw(self, job):
+		max_time = self.max_time
+		self.axes['Voltage'].axis([-10, max_time, job['voltage_range'][0], job['voltage_range'][1]])
+		if self.layout == 'live':
+			self.title.set_text('Discharge and first derivative for run #' + job['number'])
+			self.axes['Derivative'].axis([-10, max_time, -0.0015, 0.05])
+		else:
+			self.title.set_text('Discharge for run #' + job['number'])
+			self.axes['Derivative'].axis([-10, max_time, -0.002, 0.05])
+			self.axes['Concavity'].axis([-10, max_time, -0.0015, 0.0025])
+			con_threshold = job['con_threshold'] if job['con_threshold'] is not None else np.nan
+			self.thresholds[1].set_ydata([con_threshold, con_threshold])
+			self.thresholds[2].set_ydata([-con_threshold, -con_threshold])
+			#zoom on the plateau
+			self.axes['Voltage'].set_xlim(-10, min(job['marks']['Time'][1] + 80, 600))
+		self.thresholds[0].set_ydata([job['slope_threshold'], job['slope_threshold']])
+		for column in self.axes:
+			self.lines[column].set_data(job['time'], job[column.lower()])
+			self.marks[column].set_data(job['marks']['Time'], job['marks'][column])
+		self.figure.savefig(job['output'], dpi = self.dpi)
+
+_templates = {} #TracePlot of each (layout, max_time, thumbnail) in this process
+
+#draw a trace_job with the figure of its layout, building it on first use
+def render(job):
+	key = (job['layout'], job['max_time'], job['thumbnail'])
+	if key not in _templates:
+		_templates[key] = TracePlot(*key)
+	_templates[key].draw(job)
+
+#renders trace_jobs in a separate process. submit only blocks once backlog plots are waiting.
+#Errors of the rendering process are raised by close(). A plot submitted while a measurement is
+#profiled is timed as its 'plot' stage, in a record of its own written to the profile files of this process.
+class PlotRenderer:
+	def __init__(self, backlog = 16):
+		profiles = [collector.filename for collector in collectors if isinstance(collector, JsonLinesCollector)]
+		self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__)] + profiles, stdin = subprocess.PIPE)
+		self.queue = queue.Queue(backlog)
+		self.error = None
+		self.thread = threading.Thread(target = self._run, daemon = True)
+		self.thread.start()
+
+	#send the queued jobs to the rendering process
+	def _run(self):
+		while True:
+			job = self.queue.get()
+			if job is None:
+				break
+			if self.error is None:
+				try:
+					pickle.dump(job, self.process.stdin, protocol = pickle.HIGHEST_PROTOCOL)
+					self.process.stdin.flush()
+				except OSError as error:
+					self.error = error
+
+	def submit(self, job):
+		self.queue.put((current_measurement(), job))
+
+	#wait for every plot to be saved
+	def close(self):
+		self.queue.put(None)
+		self.thread.join()
+		self.process.stdin.close()
+		if self.process.wait() != 0 and self.error is None:
+			self.error = RuntimeError('plot rendering process failed with exit code %d' % self.process.returncode)
+		if self.error is not None:
+			raise self.error
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+#rendering process of PlotRenderer: draw the jobs read from stdin until it is closed,
+#profiling them into the files given as arguments
+if __name__ == '__main__':
+	for filename in sys.argv[1:]:
+		add_collector(JsonLinesCollector(filename))
+	jobs = sys.stdin.buffer
+	while True:
+		try:
+			measurement, job = pickle.load(jobs)
+		except EOFError:
+			break
+		with measurement_profile(measurement) if measurement is not None else nullcontext(), stage('plot'):
+			render(job)
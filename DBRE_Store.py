@@ -0,0 +1,73 @@
+import os
+import sys
+import sqlite3
+import pandas as pd
+
+# Append-only store of DBRE results, one row per measurement, kept in an SQLite file in
+# each experiment folder. Adding a measurement costs the same however long the history is;
+# DBRE_Summary.xlsx is only written when asked for:
+#	python DBRE_Store.py [folder ...]
+
+store_name = 'DBRE_Summary.db'
+excel_name = 'DBRE_Summary.xlsx'
+columns = ['Measurement','Hours','Date','Time','Potential','Uncertainty','Plateau_Length']
+
+class SummaryStore:
+	def __init__(self, folder = '.'):
+		self.folder = folder
+		self.connection = sqlite3.connect(os.path.join(folder, store_name))
+		self.connection.execute('CREATE TABLE IF NOT EXISTS summary (Measurement INTEGER PRIMARY KEY, Hours REAL, Date TEXT, Time TEXT, Potential REAL, Uncertainty REAL, Plateau_Length REAL)')
+
+	#add the summary rows of [(number, summary), ...] in one transaction. Re-analyzed measurements replace their row.
+	def append_many(self, rows):
+		values = [(number,) + tuple(summary[c] for c in columns[1:]) for number, summary in rows]
+		with self.connection:
+			self.connection.executemany('INSERT OR REPLACE INTO summary VALUES (?,?,?,?,?,?,?)', values)
+
+	#add the summary of measurement number
+	def append(self, number, summary):
+		self.append_many([(number, summary)])
+
+	#all rows in measurement order, or only those after measurement number after
+	def read(self, after = None):
+		if after is None:
+			return pd.read_sql_query('SELECT * FROM summary ORDER BY Measurement', self.connection)
+		return pd.read_sql_query('SELECT * FROM summary WHERE Measurement > ? ORDER BY Measurement', self.connection, params = (int(after),))
+
+	def export_excel(self, filename = None):
+		self.read().to_excel(filename or os.path.join(self.folder, excel_name))
+
+	def close(self):
+		self.connection.close()
+
+#summary rows of a folder, from its store or from a DBRE_Summary.xlsx written before the store existed. None if it has neither.
+#Those older files have no Measurement column; their rows are the measurements in order from #1.
+def read_summary(folder):
+	if os.path.isfile(os.path.join(folder, store_name)):
+		store = SummaryStore(folder)
+		summary = store.read()
+		store.close()
+		return summary
+	if os.path.isfile(os.path.join(folder, excel_name)):
+		summary = pd.read_excel(os.path.join(folder, excel_name), index_col = 0)
+		if 'Measurement' not in summary.columns:
+			summary.insert(0, 'Measurement', range(1, len(summary) + 1))
+		return summary
+	return None
+
+#summary rows of several folders, one after another
+def read_summaries(folders):
+	summaries = [read_summary(folder) for folder in folders]
+	summaries = [summary for summary in summaries if summary is not None]
+	if not summaries:
+		return pd.DataFrame(columns = columns)
+	return pd.concat(summaries, ignore_index = True)
+
+if __name__ == '__main__':
+	for folder in sys.argv[1:] or ['.']:
+		if not os.path.isfile(os.path.join(folder, store_name)):
+			print('no ' + store_name + ' in ' + folder)
+			continue
+		store = SummaryStore(folder)
+		store.export_excel()
+		store.close()
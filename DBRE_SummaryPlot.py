@@ -0,0 +1,88 @@
+import time
+import numpy as np
+
+# Salt potential over time plot that stays open during a run. New measurements are appended
+# to arrays that grow with the run instead of redrawing the whole history, and only moved
+# into the artists when the image is saved, every save_interval seconds or every
+# save_points new points, at preview_dpi. Adding a point costs the same however long the run is.
+# close() saves it once more at the full dpi. Matplotlib is imported when the plot is made.
+
+class SummaryPlot:
+	def __init__(self, filename, dpi = 300, preview_dpi = 100, save_interval = 60, save_points = 10, capsize = 5, **style):
+		self.filename = filename
+		self.dpi = dpi
+		self.preview_dpi = preview_dpi
+		self.save_interval = save_interval #seconds between saves while measurements come in
+		self.save_points = save_points #save after this many new points even if save_interval has not passed
+		self.data = np.empty((64, 3)) #hours, potential, uncertainty of each point in the order they came in, grown by doubling
+		self.rows = {} #measurement number: its row in data
+		self.pending = 0
+		self.last_save = time.monotonic()
+		from matplotlib.figure import Figure
+		from matplotlib.backends.backend_agg import FigureCanvasAgg
+		from matplotlib.collections import LineCollection
+		self.figure = Figure()
+		FigureCanvasAgg(self.figure)
+		self.figure.suptitle('Salt Potential Over Time')
+		self.axes = self.figure.add_subplot()
+		#the same look as plt.errorbar(color = 'blue', ecolor = 'black', fmt = 'o', capsize = capsize)
+		self.bars = LineCollection([], colors = 'black', linewidths = style.pop('elinewidth', None))
+		self.axes.add_collection(self.bars)
+		capthick = style.pop('capthick', None)
+		self.caps = [self.axes.plot([], [], color = 'black', marker = '_', markersize = 2*capsize, markeredgewidth = capthick, linestyle = 'none')[0] for i in range(2)]
+		self.markers, = self.axes.plot([], [], color = 'blue', marker = 'o', linestyle = 'none', **style)
+		self.axes.set_xlabel('Time (hr)')
+		self.axes.set_ylabel('Salt Potential (V vs Be|Be2+)')
+		self.axes.ticklabel_format(axis = 'x', style = 'plain', useOffset = False)
+
+	#add the rows of a summary DataFrame, e.g. what is already in the store when a run starts
+	def add_frame(self, df):
+		for row in df.itertuples():
+			self._set(row.Measurement, (row.Hours, row.Potential, row.Uncertainty))
+		self.pending += len(df)
+
+	#add the summary of measurement number, replacing it if it was re-analyzed, and save if it is time to
+	def add(self, number, summary):
+		self.put(number, summary)
+		if self.due():
+			self.save(self.preview_dpi)
+
+	#add the summary of measurement number without saving, for callers that save it elsewhere
+	def put(self, number, summary):
+		self._set(number, (summary['Hours'], summary['Potential'], summary['Uncertainty']))
+		self.pending += 1
+
+	#whether it is time to save a preview
+	def due(self):
+		return self.pending >= self.save_points or time.monotonic() - self.last_save >= self.save_interval
+
+	#append the point of a new measurement, or replace the one of a re-analyzed measurement
+	def _set(self, number, point):
+		row = self.rows.get(number)
+		if row is None:
+			row = self.rows[number] = len(self.rows)
+			if row == len(self.data):
+				self.data = np.concatenate([self.data, np.empty_like(self.data)])
+		self.data[row] = point
+
+	#move the points into the artists and rescale the axes to them
+	def _update(self):
+		if not self.rows:
+			return
+		hours, potential, uncertainty = self.data[:len(self.rows)].T
+		self.markers.set_data(hours, potential)
+		self.caps[0].set_data(hours, potential - uncertainty)
+		self.caps[1].set_data(hours, potential + uncertainty)
+		self.bars.set_segments(np.stack([np.column_stack([hours, potential - uncertainty]), np.column_stack([hours, potential + uncertainty])], axis = 1))
+		self.axes.relim()
+		self.axes.autoscale_view()
+
+	def save(self, dpi = None):
+		self._update()
+		self.figure.savefig(self.filename, dpi = dpi or self.dpi)
+		self.pending = 0
+		self.last_save = time.monotonic()
+
+	#save at the full dpi
+	def close(self):
+		self.save(self.dpi)
@@ -0,0 +1,66 @@
+import os
+import sys
+import numpy as np
+from datetime import datetime, timedelta
+from DBRE_Analysis import measurement_file
+
+# Synthetic Gamry CHRONOP .DTA files for benchmarks and checks. The header has the tags of
+# our templates, and with one note line the data table starts on line 64 like theirs; each
+# extra note line moves it down one, as with headers of other instrument setups. Each discharge has a charging step, a relaxation up onto a
+# plateau of known potential, and a rise to the rest potential once the plateau ends:
+#	python DBRE_Synthetic.py folder [measurements] [points]
+
+sample_time = 0.1 #seconds between points
+
+#header lines above the data table, in the order of the CHRONOP template
+def header_lines(stamp, charging_time, points, notes = 1):
+	lines = ['EXPLAIN', 'TAG\tCHRONOP', 'TITLE\tLABEL\tChronopotentiometry Scan\tTest &Identifier',
+		'DATE\tLABEL\t%s\tDate' % stamp.strftime('%m/%d/%Y'), 'TIME\tLABEL\t%s\tTime' % stamp.strftime('%H:%M:%S'),
+		'NOTES\tNOTES\t%d\t&Notes...' % notes]
+	lines += ['\tSynthetic DBRE discharge, note %d' % (i + 1) for i in range(notes)]
+	lines += ['PSTAT\tPSTAT\tREF600-00000\tPotentiostat',
+		'IPRESTEP\tQUANT\t0.00000E+000\tPre-step Current (A)', 'TPRESTEP\tQUANT\t0\tPre-step Time (s)',
+		'ISTEP1\tQUANT\t1.00000E-003\tStep 1 Current (A)', 'TSTEP1\tQUANT\t%g\tStep 1 Time (s)' % charging_time,
+		'ISTEP2\tQUANT\t0.00000E+000\tStep 2 Current (A)', 'TSTEP2\tQUANT\t%g\tStep 2 Time (s)' % (points*sample_time - charging_time),
+		'SAMPLETIME\tQUANT\t%g\tSample &Period (s)' % sample_time]
+	lines += ['SETUP%d\tQUANT\t0\tSetup (unused)' % i for i in range(15, 61)]
+	lines.append('CURVE\tTABLE\t%d' % points)
+	lines.append('\tPt\tT\tVf\tIm\tVu\tSig\tAch\tIERange\tOver')
+	lines.append('\t#\ts\tV vs. Ref.\tA\tV\tV\tV\t#\tbits')
+	return lines
+
+#time and voltage of a discharge. plateau_slope is in V/s, noise is the standard deviation in V.
+def discharge(points = 6000, charging_time = 3, plateau_voltage = -1.2, plateau_start = 20, plateau_length = 120,
+		plateau_slope = 0, rest_voltage = -0.6, noise = 0.0001, seed = 0):
+	t = np.arange(points)*sample_time
+	relaxing = t - charging_time
+	v = plateau_voltage - 0.3*np.exp(-np.maximum(relaxing, 0)/(plateau_start/4)) + plateau_slope*np.maximum(relaxing - plateau_start, 0)
+	v += (rest_voltage - plateau_voltage)/(1 + np.exp(-(t - charging_time - plateau_start - plateau_length)/8))
+	v[t <= charging_time] = plateau_voltage - 0.3*t[t <= charging_time]/charging_time
+	v += np.random.default_rng(seed).normal(0, noise, points)
+	return t, v
+
+#write one synthetic .DTA file. Keyword arguments go to discharge.
+def write_dta(filename, stamp = datetime(2020, 10, 27, 16, 0, 0), charging_time = 3, points = 6000, notes = 1, **shape):
+	t, v = discharge(points, charging_time, **shape)
+	lines = header_lines(stamp, charging_time, points, notes)
+	lines += ['\t%d\t%.4f\t%.6f\t1.00000E-003\t0\t0\t0\t5\t...........' % (i, t[i], v[i]) for i in range(points)]
+	with open(filename, 'w') as f:
+		f.write('\n'.join(lines) + '\n')
+
+#write measurements 1 to count into folder, one every 10 minutes, and return their file names
+def write_folder(folder, count, points = 6000, **shape):
+	os.makedirs(folder, exist_ok = True)
+	filenames = []
+	for number in range(1, count + 1):
+		filename = measurement_file(folder, number)
+		write_dta(filename, datetime(2020, 10, 27, 16, 0, 0) + timedelta(minutes = 10*number), points = points, seed = number, **shape)
+		filenames.append(filename)
+	return filenames
+
+if __name__ == '__main__':
+	if len(sys.argv) < 2:
+		sys.exit('usage: python DBRE_Synthetic.py folder [measurements] [points]')
+	count = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+	points = int(sys.argv[3]) if len(sys.argv) > 3 else 6000
+	write_folder(sys.argv[1], count, points)
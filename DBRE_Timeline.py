@@ -0,0 +1,160 @@
+import os
+import sys
+import math
+import sqlite3
+import pandas as pd
+from DBRE_Store import SummaryStore, excel_name, read_summary, store_name
+from DBRE_Plotting import pyplot
+
+# Long-term salt potential timeline. Running statistics of the potential are kept for each
+# hour, day and week of the experiment in an SQLite file: count, mean, uncertainty-weighted
+# mean, spread, min and max. A measurement updates one bucket per resolution when it comes
+# in, so adding to the timeline and plotting its overview cost the same however long the
+# campaign has run. The measurements themselves are kept too, so that a re-analyzed one
+# replaces its old values, and short campaigns can still be shown point by point:
+#	python DBRE_Timeline.py [folder ...]
+# adds the summary stores of the folders (all subfolders if none are given) to DBRE_Timeline.db
+# and plots it in DBRE_Timeline.png.
+
+timeline_name = 'DBRE_Timeline.db'
+plot_name = 'DBRE_Timeline.png'
+timeline_excel_name = 'DBRE_Timeline.xlsx'
+resolutions = {'hour': 1, 'day': 24, 'week': 168} #bucket widths in hours, finest first
+max_points = 1000 #points plotted at most, the finest resolution with no more buckets is used
+
+class PotentialTimeline:
+	def __init__(self, folder = '.'):
+		self.folder = folder
+		self.connection = sqlite3.connect(os.path.join(folder, timeline_name))
+		with self.connection:
+			#the measurements in the timeline, by folder (see _key). Potential is NULL for a measurement without plateau.
+			self.connection.execute('CREATE TABLE IF NOT EXISTS members (Folder TEXT, Measurement INTEGER, Hours REAL, Potential REAL, Uncertainty REAL, PRIMARY KEY (Folder, Measurement))')
+			self.connection.execute('CREATE INDEX IF NOT EXISTS members_hours ON members (Hours)')
+			#Weight is the sum of 1/Uncertainty^2 over the measurements with an uncertainty
+			self.connection.execute('CREATE TABLE IF NOT EXISTS buckets (Resolution TEXT, Bucket INTEGER, Count INTEGER, Hours_Sum REAL, Sum REAL, Sum_Sq REAL, Weight REAL, Weighted_Sum REAL, Min REAL, Max REAL, PRIMARY KEY (Resolution, Bucket))')
+
+	#add the summaries of [(number, summary), ...] of measurements in folder. Re-analyzed measurements replace their old values.
+	def add_many(self, folder, rows):
+		folder = self._key(folder)
+		with self.connection:
+			for number, summary in rows:
+				new = (float(summary['Hours']), _finite(summary['Potential']), _finite(summary['Uncertainty']))
+				old = self.connection.execute('SELECT Hours, Potential, Uncertainty FROM members WHERE Folder = ? AND Measurement = ?', (folder, int(number))).fetchone()
+				if old == new:
+					continue
+				self.connection.execute('INSERT OR REPLACE INTO members VALUES (?,?,?,?,?)', (folder, int(number)) + new)
+				if old is not None:
+					self._remove(*old)
+				self._add(*new)
+
+	#add the summary of measurement number of folder
+	def add(self, folder, number, summary):
+		self.add_many(folder, [(number, summary)])
+
+	#add the measurements of folder's summary store (or older DBRE_Summary.xlsx) that come after the last one in the timeline
+	def sync(self, folder):
+		last = self.connection.execute('SELECT MAX(Measurement) FROM members WHERE Folder = ?', (self._key(folder),)).fetchone()[0]
+		if os.path.isfile(os.path.join(folder, store_name)):
+			store = SummaryStore(folder)
+			df = store.read(after = last)
+			store.close()
+		elif os.path.isfile(os.path.join(folder, excel_name)):
+			df = read_summary(folder)
+			df = df[df.Measurement > last] if last is not None else df
+		else:
+			return
+		self.add_many(folder, ((row['Measurement'], row) for row in df.to_dict('records')))
+
+	#folder as kept in members: its path from the timeline's folder, the same however the caller spells it
+	#(e.g. '.' from a script running in the folder or 'c1' from the monitor) and after the folders are moved
+	def _key(self, folder):
+		return os.path.relpath(os.path.realpath(folder), os.path.realpath(self.folder))
+
+	def _add(self, hours, potential, uncertainty):
+		if potential is None:
+			return
+		weight = 1/uncertainty**2 if uncertainty else 0.0
+		values = [(name, math.floor(hours/width), 1, hours, potential, potential**2, weight, weight*potential, potential, potential) for name, width in resolutions.items()]
+		self.connection.executemany('INSERT INTO buckets VALUES (?,?,?,?,?,?,?,?,?,?) ON CONFLICT (Resolution, Bucket) DO UPDATE SET '
+			'Count = Count + excluded.Count, Hours_Sum = Hours_Sum + excluded.Hours_Sum, Sum = Sum + excluded.Sum, Sum_Sq = Sum_Sq + excluded.Sum_Sq, '
+			'Weight = Weight + excluded.Weight, Weighted_Sum = Weighted_Sum + excluded.Weighted_Sum, Min = MIN(Min, excluded.Min), Max = MAX(Max, excluded.Max)', values)
+
+	#take the old values of a measurement out of its buckets, once members has its new values
+	def _remove(self, hours, potential, uncertainty):
+		if potential is None:
+			return
+		weight = 1/uncertainty**2 if uncertainty else 0.0
+		for name, width in resolutions.items():
+			bucket = math.floor(hours/width)
+			self.connection.execute('UPDATE buckets SET Count = Count - 1, Hours_Sum = Hours_Sum - ?, Sum = Sum - ?, Sum_Sq = Sum_Sq - ?, '
+				'Weight = Weight - ?, Weighted_Sum = Weighted_Sum - ? WHERE Resolution = ? AND Bucket = ?', (hours, potential, potential**2, weight, weight*potential, name, bucket))
+			#min and max cannot be taken back, so they are found again from the measurements left in the bucket
+			self.connection.execute('UPDATE buckets SET (Min, Max) = (SELECT MIN(Potential), MAX(Potential) FROM members WHERE Hours >= ? AND Hours < ? AND Potential IS NOT NULL) '
+				'WHERE Resolution = ? AND Bucket = ?', (bucket*width, (bucket + 1)*width, name, bucket))
+		self.connection.execute('DELETE FROM buckets WHERE Count <= 0')
+
+	#number of points at each resolution, with 'measurement' for the measurements themselves
+	def sizes(self):
+		sizes = {'measurement': self.connection.execute('SELECT COUNT(*) FROM members WHERE Potential IS NOT NULL').fetchone()[0]}
+		sizes.update({name: 0 for name in resolutions})
+		sizes.update(self.connection.execute('SELECT Resolution, COUNT(*) FROM buckets GROUP BY Resolution'))
+		return sizes
+
+	#finest resolution with at most max_points points, or the coarsest one
+	def resolution(self, max_points = max_points):
+		sizes = self.sizes()
+		return next((name for name in sizes if sizes[name] <= max_points), list(resolutions)[-1])
+
+	#potential over time at resolution ('measurement', 'hour', 'day' or 'week'), by default the finest
+	#one with at most max_points points. Columns Hours (mean time of the bucket), Potential (weighted
+	#mean, or mean without uncertainties), Uncertainty (of the weighted mean), Mean, Std, Min, Max, Count.
+	def series(self, resolution = None, max_points = max_points):
+		resolution = resolution or self.resolution(max_points)
+		if resolution == 'measurement':
+			df = pd.read_sql_query('SELECT Hours, Potential, Uncertainty FROM members WHERE Potential IS NOT NULL ORDER BY Hours', self.connection)
+			return df.assign(Mean = df.Potential, Std = 0.0, Min = df.Potential, Max = df.Potential, Count = 1)
+		df = pd.read_sql_query('SELECT * FROM buckets WHERE Resolution = ? ORDER BY Bucket', self.connection, params = (resolution,))
+		mean = df.Sum/df.Count
+		weighted = df.Weight > 0
+		return pd.DataFrame({'Hours': df.Hours_Sum/df.Count,
+			'Potential': (df.Weighted_Sum/df.Weight).where(weighted, mean),
+			'Uncertainty': (1/df.Weight**0.5).where(weighted),
+			'Mean': mean, 'Std': (df.Sum_Sq/df.Count - mean**2).clip(lower = 0)**0.5,
+			'Min': df.Min, 'Max': df.Max, 'Count': df.Count})
+
+	#write the series of every resolution to DBRE_Timeline.xlsx, one sheet each
+	def export_excel(self, filename = None):
+		with pd.ExcelWriter(filename or os.path.join(self.folder, timeline_excel_name)) as writer:
+			for name in resolutions:
+				self.series(name).to_excel(writer, sheet_name = name)
+
+	def close(self):
+		self.connection.close()
+
+#plot a series of PotentialTimeline: the potential with its uncertainty, and the range of each bucket
+def plot_timeline(df, filename, resolution = 'measurement', **style):
+	plt = pyplot()
+	plt.figure()
+	plt.suptitle('Salt Potential Over Time' + ('' if resolution == 'measurement' else ' (mean of each %s)' % resolution))
+	if resolution != 'measurement':
+		plt.fill_between(df.Hours, df.Min, df.Max, color = 'blue', alpha = 0.2, linewidth = 0)
+	plt.errorbar(df.Hours, df.Potential, yerr = df.Uncertainty, color = 'blue', ecolor = 'black', fmt = 'o', **style)
+	plt.xlabel('Time (hr)')
+	plt.ylabel('Salt Potential (V vs Be|Be2+)')
+	plt.ticklabel_format(axis = 'x', style = 'plain', useOffset = False)
+	plt.savefig(filename, dpi=300)
+	plt.close()
+
+#finite value as a float, or None
+def _finite(value):
+	value = float(value)
+	return value if math.isfinite(value) else None
+
+if __name__ == '__main__':
+	folders = sys.argv[1:] or sorted(d.path for d in os.scandir('.') if d.is_dir())
+	timeline = PotentialTimeline('.')
+	for folder in folders:
+		timeline.sync(folder)
+	resolution = timeline.resolution()
+	plot_timeline(timeline.series(resolution), plot_name, resolution, capsize = 1, markersize = 1, elinewidth = 0.2, capthick = 0.2)
+	timeline.close()